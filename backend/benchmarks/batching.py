@@ -0,0 +1,133 @@
+"""
+Benchmark: a burst of messages to a busy room, with and without frame batching.
+
+Every member is a real ChatConsumer on its own channel. Its WebSocket send
+writes the frame to /dev/null, so each frame costs JSON encoding plus one
+write syscall, as on a real socket. A burst of --messages broadcasts is
+published back to back, and the run ends once every member has received
+every message.
+
+Usage (from backend/):
+    python benchmarks/batching.py --members 500 --messages 200
+    python benchmarks/batching.py --delay-ms 10 --max-size 100
+
+"frames/socket" is how many WebSocket frames each member received;
+"latency" is from publishing a message to it reaching the first member.
+"""
+import argparse
+import asyncio
+import json
+import os
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'chatapp.settings')
+os.environ.setdefault('SECRET_KEY', 'benchmark')
+
+import django  # noqa: E402
+django.setup()
+
+from django.conf import settings  # noqa: E402
+from fanout import GROUP, CountingChannelLayer, make_member, per_socket_receiver  # noqa: E402
+
+
+class Sockets:
+    """Writes frames to /dev/null and counts the chat messages they carry"""
+
+    def __init__(self, devnull):
+        self.devnull = devnull
+        self.frames = 0
+        self.messages = 0
+        self.target = None
+        self.done = asyncio.Event()
+        self.latencies = []
+
+    async def send(self, message):
+        text = message['text']
+        os.write(self.devnull, text.encode())
+        self.frames += 1
+        self.messages += text.count('"type": "chat_message"')
+        if self.messages >= self.target:
+            self.done.set()
+
+    async def send_first(self, message):
+        # The first member also records when each message arrived
+        now = time.perf_counter()
+        frame = json.loads(message['text'])
+        for item in frame.get('messages', [frame]):
+            self.latencies.append(now - float(item['timestamp']))
+        await self.send(message)
+
+
+async def run(members, messages, batching):
+    settings.CHAT_BATCH_FRAMES = batching
+    channel_layer = CountingChannelLayer()
+    devnull = os.open(os.devnull, os.O_WRONLY)
+    sockets = Sockets(devnull)
+    sockets.target = members * messages
+
+    tasks = []
+    for i in range(members):
+        member = make_member(channel_layer, sockets)
+        if i == 0:
+            member.base_send = sockets.send_first
+        member.channel_name = await channel_layer.new_channel()
+        await channel_layer.group_add(GROUP, member.channel_name)
+        tasks.append(asyncio.ensure_future(per_socket_receiver(channel_layer, member.channel_name, member)))
+
+    started = time.perf_counter()
+    cpu_started = time.process_time()
+    for i in range(messages):
+        await channel_layer.group_send(GROUP, {
+            'type': 'chat_message',
+            'message': f'burst {i}',
+            'username': 'bot',
+            # Carries the publish time for the latency figures
+            'timestamp': repr(time.perf_counter()),
+        })
+        # Let receivers run between publishes, as with a remote publisher
+        await asyncio.sleep(0)
+    await asyncio.wait_for(sockets.done.wait(), timeout=120)
+    elapsed = time.perf_counter() - started
+    cpu = time.process_time() - cpu_started
+
+    for task in tasks:
+        task.cancel()
+    await asyncio.gather(*tasks, return_exceptions=True)
+    os.close(devnull)
+
+    latencies = sorted(sockets.latencies)
+    return {
+        'mode': f'batching ({settings.CHAT_BATCH_MAX_DELAY_MS:g}ms/{settings.CHAT_BATCH_MAX_SIZE})' if batching else 'one frame per message',
+        'deliveries/s': members * messages / elapsed,
+        'cpu ms': cpu * 1000,
+        'frames/socket': sockets.frames / members,
+        'p50 latency ms': statistics.median(latencies) * 1000,
+        'max latency ms': latencies[-1] * 1000,
+    }
+
+
+async def main(args):
+    settings.CHAT_BATCH_MAX_DELAY_MS = args.delay_ms
+    settings.CHAT_BATCH_MAX_SIZE = args.max_size
+    settings.CHAT_LOCAL_FANOUT = False
+
+    results = [await run(args.members, args.messages, batching) for batching in (False, True)]
+
+    print(f"{args.members} members, burst of {args.messages} messages")
+    for result in results:
+        print('  ' + ', '.join(
+            f"{key}: {value:.1f}" if isinstance(value, float) else f"{key}: {value}"
+            for key, value in result.items()
+        ))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--members', type=int, default=500)
+    parser.add_argument('--messages', type=int, default=200)
+    parser.add_argument('--delay-ms', type=float, default=5, help='CHAT_BATCH_MAX_DELAY_MS')
+    parser.add_argument('--max-size', type=int, default=50, help='CHAT_BATCH_MAX_SIZE')
+    asyncio.run(main(parser.parse_args()))
@@ -0,0 +1,169 @@
+"""
+Benchmark: broadcasting to a room with thousands of members.
+
+Compares the default per-socket group membership with local fan-out
+(settings.CHAT_LOCAL_FANOUT). Each simulated member is a real ChatConsumer
+whose WebSocket send is replaced by a counter, so JSON encoding and dispatch
+are included in the timings.
+
+Usage (from backend/):
+    python benchmarks/fanout.py --members 5000 --messages 50 --processes 4
+    python benchmarks/fanout.py --redis localhost   # use channels_redis
+
+With the in-memory layer, "layer sends/msg" is the number of per-channel
+sends a group_send performed, i.e. what channels_redis does against Redis.
+"""
+import argparse
+import asyncio
+import os
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'chatapp.settings')
+os.environ.setdefault('SECRET_KEY', 'benchmark')
+
+import django  # noqa: E402
+django.setup()
+
+from channels.layers import InMemoryChannelLayer  # noqa: E402
+from core.consumers import ChatConsumer  # noqa: E402
+from core.fanout import LocalFanout  # noqa: E402
+
+GROUP = 'chat_benchmark'
+
+
+class CountingChannelLayer(InMemoryChannelLayer):
+    """In-memory layer that counts the per-channel sends done by group_send"""
+
+    def __init__(self, **kwargs):
+        super().__init__(capacity=10000, **kwargs)
+        self.sends = 0
+
+    async def send(self, channel, message):
+        self.sends += 1
+        await super().send(channel, message)
+
+    def _clean_expired(self):
+        # The stock layer scans every channel on each receive, which would
+        # dominate the timings with thousands of sockets; nothing expires here
+        pass
+
+
+class Delivery:
+    """Counts frames written to sockets and wakes the benchmark at a target"""
+
+    def __init__(self):
+        self.frames = 0
+        self.target = None
+        self.done = asyncio.Event()
+
+    async def send(self, message):
+        self.frames += 1
+        if self.frames == self.target:
+            self.done.set()
+
+
+def make_member(channel_layer, delivery):
+    member = ChatConsumer()
+    member.channel_layer = channel_layer
+    member.room_name = 'benchmark'
+    member.room_group_name = GROUP
+    member.base_send = delivery.send
+    return member
+
+
+async def per_socket_receiver(channel_layer, channel_name, member):
+    # What AsyncConsumer.__call__ does for every socket's own channel
+    while True:
+        await member.dispatch(await channel_layer.receive(channel_name))
+
+
+async def setup(channel_layer, delivery, members, processes, fanout_mode):
+    tasks = []
+    registries = [LocalFanout() for _ in range(processes)]
+    for i in range(members):
+        member = make_member(channel_layer, delivery)
+        if fanout_mode:
+            await registries[i % processes].join(GROUP, member)
+        else:
+            member.channel_name = await channel_layer.new_channel()
+            await channel_layer.group_add(GROUP, member.channel_name)
+            tasks.append(asyncio.ensure_future(
+                per_socket_receiver(channel_layer, member.channel_name, member)
+            ))
+    return registries, tasks
+
+
+async def run(channel_layer, members, messages, processes, fanout_mode):
+    delivery = Delivery()
+    registries, tasks = await setup(channel_layer, delivery, members, processes, fanout_mode)
+    sends_before = getattr(channel_layer, 'sends', 0)
+
+    latencies = []
+    started = time.perf_counter()
+    cpu_started = time.process_time()
+    for i in range(messages):
+        delivery.target = members * (i + 1)
+        delivery.done.clear()
+        sent = time.perf_counter()
+        await channel_layer.group_send(GROUP, {
+            'type': 'chat_message',
+            'message': f'announcement {i}',
+            'username': 'benchmark',
+            'timestamp': '2024-01-01T00:00:00+00:00',
+        })
+        await asyncio.wait_for(delivery.done.wait(), timeout=60)
+        latencies.append(time.perf_counter() - sent)
+    elapsed = time.perf_counter() - started
+    cpu = time.process_time() - cpu_started
+
+    layer_sends = getattr(channel_layer, 'sends', 0) - sends_before
+    for registry in registries:
+        tasks.extend(subscription.task for subscription in registry.subscriptions.values())
+    for task in tasks:
+        task.cancel()
+    await asyncio.gather(*tasks, return_exceptions=True)
+
+    latencies.sort()
+    return {
+        'mode': f'local fan-out ({processes} proc)' if fanout_mode else 'per-socket groups',
+        'deliveries/s': members * messages / elapsed,
+        'cpu ms/msg': cpu / messages * 1000,
+        'p50 ms': statistics.median(latencies) * 1000,
+        'p99 ms': latencies[int(len(latencies) * 0.99) - 1 if len(latencies) > 1 else 0] * 1000,
+        'layer sends/msg': layer_sends / messages if layer_sends else float('nan'),
+    }
+
+
+def make_layer(redis_host):
+    if not redis_host:
+        return CountingChannelLayer()
+    from channels_redis.core import RedisChannelLayer
+    return RedisChannelLayer(hosts=[(redis_host, 6379)], capacity=10000)
+
+
+async def main(args):
+    results = []
+    for fanout_mode in (False, True):
+        channel_layer = make_layer(args.redis)
+        results.append(await run(channel_layer, args.members, args.messages, args.processes, fanout_mode))
+
+    print(f"{args.members} members, {args.messages} messages, "
+          f"{'redis' if args.redis else 'in-memory'} channel layer")
+    for result in results:
+        print('  ' + ', '.join(
+            f"{key}: {value:.1f}" if isinstance(value, float) else f"{key}: {value}"
+            for key, value in result.items()
+        ))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--members', type=int, default=5000)
+    parser.add_argument('--messages', type=int, default=50)
+    parser.add_argument('--processes', type=int, default=4,
+                        help='Simulated worker processes in fan-out mode')
+    parser.add_argument('--redis', help='Redis host; benchmarks channels_redis instead of the in-memory layer')
+    asyncio.run(main(parser.parse_args()))
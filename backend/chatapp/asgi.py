@@ -16,6 +16,7 @@ from channels.security.websocket import AllowedHostsOriginValidator  # ensures H
 
 # Import your websocket url patterns (do this after Django setup)
 from core.routing import websocket_urlpatterns
+from core.middleware import ConnectionLimitMiddleware
 
 # ProtocolTypeRouter maps protocol names to ASGI apps.
 # - "http" goes to the normal Django ASGI app
@@ -25,9 +26,11 @@ application = ProtocolTypeRouter({
     "http": django_asgi_app,
 
     # Handles WebSocket connections
-    "websocket": AllowedHostsOriginValidator(               # optional security layer
-        AuthMiddlewareStack(                               # adds Django user/auth support on websocket
-            URLRouter(websocket_urlpatterns)               # routes websocket paths to consumers
+    "websocket": ConnectionLimitMiddleware(                 # per-process connection budget
+        AllowedHostsOriginValidator(                       # optional security layer
+            AuthMiddlewareStack(                           # adds Django user/auth support on websocket
+                URLRouter(websocket_urlpatterns)           # routes websocket paths to consumers
+            )
         )
     ),
 })
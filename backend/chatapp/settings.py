@@ -11,6 +11,7 @@ https://docs.djangoproject.com/en/4.2/ref/settings/
 """
 import os
 import os
+import sys
 from pathlib import Path
 import dj_database_url
 
@@ -91,6 +92,106 @@ CHANNEL_LAYERS = {
     },
 }
 
+# Maximum open WebSockets per server process (0 = unlimited).
+# `manage.py serve --max-connections` overrides it for each worker.
+WEBSOCKET_MAX_CONNECTIONS = int(os.environ.get('WEBSOCKET_MAX_CONNECTIONS', 0))
+# Base delay (seconds, jittered up to 2x) that rejected clients are told to wait
+WEBSOCKET_RETRY_AFTER = float(os.environ.get('WEBSOCKET_RETRY_AFTER', 5))
+
+# Heartbeats and timeouts of chat sockets, in seconds (see core/connections.py).
+# Every HEARTBEAT_INTERVAL the server pings each socket; one that sent nothing
+# (not even a pong) for HEARTBEAT_TIMEOUT is closed. IDLE_TIMEOUT closes
+# sockets without chat traffic from the client and MAX_LIFETIME closes them
+# regardless, so clients reconnect and rebalance. 0 disables each.
+WEBSOCKET_HEARTBEAT_INTERVAL = float(os.environ.get('WEBSOCKET_HEARTBEAT_INTERVAL', 25))
+WEBSOCKET_HEARTBEAT_TIMEOUT = float(os.environ.get('WEBSOCKET_HEARTBEAT_TIMEOUT', 60))
+WEBSOCKET_IDLE_TIMEOUT = float(os.environ.get('WEBSOCKET_IDLE_TIMEOUT', 0))
+WEBSOCKET_MAX_LIFETIME = float(os.environ.get('WEBSOCKET_MAX_LIFETIME', 0))
+
+# Subscribe each process once per room and fan group messages out in memory,
+# so a message costs the channel layer O(processes) instead of O(members)
+CHAT_LOCAL_FANOUT = os.environ.get('CHAT_LOCAL_FANOUT', 'False') == 'True'
+
+# Coalesce chat frames that arrive within CHAT_BATCH_MAX_DELAY_MS of each other
+# into one `chat_batch` frame of at most CHAT_BATCH_MAX_SIZE messages. Off by
+# default: in benchmarks/batching.py (500 members, 200-message burst) it cut
+# frames per socket 200 -> 100 but lowered throughput (46k -> 36k deliveries/s),
+# raised CPU (2.1 -> 2.7 s) and p50 latency (4 -> 12 ms, max ~50 ms at 5 ms delay)
+CHAT_BATCH_FRAMES = os.environ.get('CHAT_BATCH_FRAMES', 'False') == 'True'
+CHAT_BATCH_MAX_DELAY_MS = float(os.environ.get('CHAT_BATCH_MAX_DELAY_MS', 5))
+CHAT_BATCH_MAX_SIZE = int(os.environ.get('CHAT_BATCH_MAX_SIZE', 50))
+
+# Most messages one request to the bulk-post endpoints may carry
+BULK_MESSAGES_MAX = int(os.environ.get('BULK_MESSAGES_MAX', 500))
+
+# Idempotency keys of bulk posts are honoured (and kept) this long; older ones
+# are deleted by `purge_idempotency_keys` (from cron, or with --follow)
+IDEMPOTENCY_KEY_RETENTION_HOURS = float(os.environ.get('IDEMPOTENCY_KEY_RETENTION_HOURS', 24))
+
+# Activity rollups (core.rollups) skip messages younger than this, so slow
+# transactions holding lower ids commit before the watermark passes them
+ACTIVITY_ROLLUP_LAG_SECONDS = int(os.environ.get('ACTIVITY_ROLLUP_LAG_SECONDS', 5))
+
+# On-demand profiling of consumer connect/receive calls and API requests.
+# PROFILING_SAMPLE_RATE is the fraction of calls written as pstats files to
+# PROFILING_DIR; any call slower than PROFILING_SLOW_MS is logged with its SQL
+# query count and time. Both default to off.
+PROFILING_SAMPLE_RATE = float(os.environ.get('PROFILING_SAMPLE_RATE', 0))
+PROFILING_SLOW_MS = float(os.environ.get('PROFILING_SLOW_MS', 0))
+PROFILING_DIR = os.environ.get('PROFILING_DIR', str(BASE_DIR / 'profiles'))
+
+# Logging: JSON lines to stdout, written by a background thread (core/logs.py)
+# so that log I/O never blocks the event loop.
+# Per-logger knobs, as comma-separated name=value pairs:
+#   LOG_LEVELS="core.consumers=WARNING,core.fanout=DEBUG"
+#   LOG_SAMPLING="core.consumers=0.01"  (fraction of records below WARNING kept)
+# Quiet under the test runner (tests check logging with assertLogs); set
+# LOG_LEVEL to see the records there
+TESTING = sys.argv[1:2] == ['test'] or 'pytest' in sys.modules
+LOG_LEVEL = os.environ.get('LOG_LEVEL', 'CRITICAL' if TESTING else 'INFO')
+LOG_LEVELS = dict(
+    item.strip().split('=', 1) for item in os.environ.get('LOG_LEVELS', '').split(',') if '=' in item
+)
+LOG_SAMPLING = {
+    name: float(rate) for name, rate in (
+        item.strip().split('=', 1) for item in os.environ.get('LOG_SAMPLING', '').split(',') if '=' in item
+    )
+}
+
+LOGGING = {
+    'version': 1,
+    'disable_existing_loggers': False,
+    'formatters': {
+        'json': {'()': 'core.logs.JSONFormatter'},
+    },
+    'filters': {
+        f'sample:{name}': {'()': 'core.logs.SamplingFilter', 'rate': rate}
+        for name, rate in LOG_SAMPLING.items()
+    },
+    'handlers': {
+        'background': {
+            'class': 'core.logs.BackgroundHandler',
+            'formatter': 'json',
+            'stream': 'ext://sys.stdout',
+        },
+    },
+    'root': {
+        'handlers': ['background'],
+        'level': LOG_LEVEL,
+    },
+    'loggers': {
+        # Replaces Django's console handler, which would print a second copy
+        'django': {'handlers': ['background'], 'level': LOG_LEVEL, 'propagate': False},
+        **{
+            name: {
+                'level': LOG_LEVELS.get(name, LOG_LEVEL),
+                'filters': [f'sample:{name}'] if name in LOG_SAMPLING else [],
+            }
+            for name in {*LOG_LEVELS, *LOG_SAMPLING}
+        },
+    },
+}
+
 
 # CORS Settings
 CORS_ALLOWED_ORIGINS = os.environ.get('CORS_ALLOWED_ORIGINS', "http://localhost:3000,http://127.0.0.1:3000").split(',')
@@ -108,6 +209,33 @@ DATABASES = {
     )
 }
 
+# Read replicas, as comma-separated database URLs. Read-only API actions and
+# the consumers' history loaders use them (see core/replicas.py); a client
+# that just wrote is pinned to the primary for REPLICA_PIN_SECONDS.
+# Locally: DATABASE_REPLICA_URLS=sqlite:///replica.sqlite3
+DATABASE_REPLICAS = []
+for index, url in enumerate(filter(None, os.environ.get('DATABASE_REPLICA_URLS', '').split(','))):
+    alias = f'replica_{index}'
+    DATABASES[alias] = dj_database_url.parse(url.strip(), conn_max_age=600)
+    # Tests run against the primary's test database
+    DATABASES[alias]['TEST'] = {'MIRROR': 'default'}
+    DATABASE_REPLICAS.append(alias)
+
+DATABASE_ROUTERS = ['core.replicas.ReplicaRouter']
+REPLICA_PIN_SECONDS = int(os.environ.get('REPLICA_PIN_SECONDS', 5))
+REPLICA_PIN_CACHE = 'replica_pins'
+
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    },
+    # Shared by all server processes, so a pin holds whichever worker serves the next read
+    'replica_pins': {
+        'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+        'LOCATION': f"redis://{os.environ.get('REDIS_HOST', 'redis')}:6379/1",
+    },
+}
+
 
 # Password validation
 # https://docs.djangoproject.com/en/4.2/ref/settings/#auth-password-validators
@@ -146,6 +274,14 @@ USE_TZ = True
 STATIC_URL = 'static/'
 STATIC_ROOT = BASE_DIR / 'staticfiles'
 
+# Chat attachments, stored by content hash under ATTACHMENT_ROOT
+MEDIA_ROOT = Path(os.environ.get('MEDIA_ROOT', BASE_DIR / 'media'))
+ATTACHMENT_ROOT = MEDIA_ROOT / 'attachments'
+ATTACHMENT_MAX_SIZE = int(os.environ.get('ATTACHMENT_MAX_SIZE', 25 * 1024 * 1024))
+# Internal nginx location that maps to ATTACHMENT_ROOT (e.g. '/protected-attachments/').
+# When set, downloads are handed to nginx with X-Accel-Redirect instead of streamed by Django.
+ATTACHMENT_ACCEL_REDIRECT = os.environ.get('ATTACHMENT_ACCEL_REDIRECT', '')
+
 # Default primary key field type
 # https://docs.djangoproject.com/en/4.2/ref/settings/#default-auto-field
 
@@ -17,7 +17,7 @@ Including another URLconf
 from django.contrib import admin
 from django.urls import path, include
 from rest_framework.routers import DefaultRouter
-from core.views import RoomViewSet, MessageViewSet, UserViewSet, DirectMessageViewSet
+from core.views import RoomViewSet, MessageViewSet, UserViewSet, DirectMessageViewSet, AttachmentViewSet
 
 # Create router and register viewsets
 router = DefaultRouter()
@@ -25,6 +25,7 @@ router.register(r'rooms', RoomViewSet, basename='room')
 router.register(r'messages', MessageViewSet, basename='message')
 router.register(r'users', UserViewSet, basename='user')
 router.register(r'direct-messages', DirectMessageViewSet, basename='directmessage')
+router.register(r'attachments', AttachmentViewSet, basename='attachment')
 
 urlpatterns = [
     path('admin/', admin.site.urls),
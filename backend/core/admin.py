@@ -1,5 +1,45 @@
 from django.contrib import admin
-from .models import Room, Message
+from django.db.models import Count, IntegerField, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+from .models import Room, Message, DirectMessage
+from .pagination import EstimatedCountPaginator
+
+
+def content_preview(obj):
+    return obj.content[:50] + '...' if len(obj.content) > 50 else obj.content
+
+
+class RoomNameFilter(admin.SimpleListFilter):
+    """
+    Filter by a typed room name. The default related filter loads and
+    renders a link for every room on each changelist load.
+    """
+    title = 'room'
+    parameter_name = 'room'
+    template = 'admin/core/input_filter.html'
+
+    def lookups(self, request, model_admin):
+        # Only needed so the filter is shown; there are no fixed choices
+        return [('', '')]
+
+    def queryset(self, request, queryset):
+        if self.value():
+            return queryset.filter(room__name=self.value())
+        return queryset
+
+    def choices(self, changelist):
+        yield {
+            'selected': not self.value(),
+            'query_string': changelist.get_query_string(remove=[self.parameter_name]),
+            'display': 'All',
+        }
+        yield {
+            'form': True,
+            'parameter_name': self.parameter_name,
+            'value': self.value(),
+            'placeholder': 'Room name',
+            'hidden': [(k, v) for k, v in changelist.params.items() if k != self.parameter_name],
+        }
 
 
 @admin.register(Room)
@@ -8,18 +48,53 @@ class RoomAdmin(admin.ModelAdmin):
     search_fields = ['name']
     readonly_fields = ['created_at']
     
+    def get_queryset(self, request):
+        # Correlated subquery instead of JOIN + GROUP BY: the database only
+        # counts messages for the rooms on the current page.
+        message_count = (
+            Message.objects.filter(room=OuterRef('pk'))
+            .order_by()
+            .values('room')
+            .annotate(count=Count('*'))
+            .values('count')
+        )
+        return super().get_queryset(request).annotate(
+            _message_count=Coalesce(Subquery(message_count, output_field=IntegerField()), 0)
+        )
+    
     def message_count(self, obj):
-        return obj.messages.count()
+        return obj._message_count
     message_count.short_description = 'Messages'
+    message_count.admin_order_field = '_message_count'
 
 
 @admin.register(Message)
 class MessageAdmin(admin.ModelAdmin):
     list_display = ['user', 'room', 'content_preview', 'timestamp']
-    list_filter = ['room', 'timestamp']
+    list_filter = [RoomNameFilter, 'timestamp']
+    list_select_related = ['user', 'room']
     search_fields = ['content', 'user__username']
     readonly_fields = ['timestamp']
+    raw_id_fields = ['user', 'room']
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
+    
+    def content_preview(self, obj):
+        return content_preview(obj)
+    content_preview.short_description = 'Content'
+
+
+@admin.register(DirectMessage)
+class DirectMessageAdmin(admin.ModelAdmin):
+    list_display = ['sender', 'recipient', 'content_preview', 'timestamp', 'is_read']
+    list_filter = ['is_read', 'timestamp']
+    list_select_related = ['sender', 'recipient']
+    search_fields = ['content', 'sender__username', 'recipient__username']
+    readonly_fields = ['timestamp']
+    raw_id_fields = ['sender', 'recipient']
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
     
     def content_preview(self, obj):
-        return obj.content[:50] + '...' if len(obj.content) > 50 else obj.content
+        return content_preview(obj)
     content_preview.short_description = 'Content'
@@ -0,0 +1,262 @@
+import hashlib
+import os
+import re
+import tempfile
+from pathlib import Path
+
+from django.conf import settings
+from django.core.files.uploadedfile import UploadedFile
+from django.core.files.uploadhandler import FileUploadHandler, StopUpload
+from django.http import FileResponse, Http404, HttpResponse, StreamingHttpResponse
+from django.urls import reverse
+from django.utils.http import content_disposition_header
+from .models import Attachment
+
+# Attachments a single chat message may reference
+MAX_ATTACHMENTS_PER_MESSAGE = 10
+
+RANGE_RE = re.compile(r'^bytes=(\d*)-(\d*)$')
+
+# Served inline; anything else (SVG and HTML included) is forced to download,
+# since the content type comes from the uploader
+INLINE_CONTENT_TYPES = {'image/png', 'image/jpeg', 'image/gif', 'image/webp'}
+
+
+def attachment_root():
+    return Path(settings.ATTACHMENT_ROOT)
+
+
+def attachment_metadata(attachment):
+    """What broadcasts and history frames carry instead of the file itself"""
+    return {
+        "id": attachment.id,
+        "filename": attachment.filename,
+        "content_type": attachment.content_type,
+        "size": attachment.size,
+        "url": reverse('attachment-download', args=[attachment.id]),
+    }
+
+
+class HashedUploadedFile(UploadedFile):
+    """An upload already written to a temp file under ATTACHMENT_ROOT, with its SHA-256"""
+
+    def __init__(self, file, name, content_type, size, charset, sha256):
+        super().__init__(file, name, content_type, size, charset)
+        self.sha256 = sha256
+
+    def temporary_file_path(self):
+        return self.file.name
+
+
+class AttachmentUploadHandler(FileUploadHandler):
+    """
+    Streams each uploaded file chunk by chunk to a temp file next to the
+    attachment store, hashing it on the way, so an upload is never held in
+    memory and can be moved into place with a rename.
+    """
+
+    def new_file(self, *args, **kwargs):
+        super().new_file(*args, **kwargs)
+        tmp_dir = attachment_root() / 'tmp'
+        tmp_dir.mkdir(parents=True, exist_ok=True)
+        self.file = tempfile.NamedTemporaryFile(dir=tmp_dir, delete=False)
+        self.hasher = hashlib.sha256()
+        self.received = 0
+
+    def receive_data_chunk(self, raw_data, start):
+        self.received += len(raw_data)
+        if self.received > settings.ATTACHMENT_MAX_SIZE:
+            self.discard()
+            raise StopUpload(connection_reset=True)
+        self.hasher.update(raw_data)
+        self.file.write(raw_data)
+
+    def file_complete(self, file_size):
+        self.file.flush()
+        self.file.seek(0)
+        return HashedUploadedFile(
+            file=self.file,
+            name=self.file_name,
+            content_type=self.content_type,
+            size=file_size,
+            charset=self.charset,
+            sha256=self.hasher.hexdigest(),
+        )
+
+    def upload_interrupted(self):
+        if hasattr(self, 'file'):
+            self.discard()
+
+    def discard(self):
+        self.file.close()
+        try:
+            os.remove(self.file.name)
+        except FileNotFoundError:
+            pass
+
+
+def store_upload(upload, uploaded_by=None):
+    """
+    Move a HashedUploadedFile into the content-addressed store and record it.
+    Identical content is written to disk only once.
+    """
+    attachment = Attachment(
+        sha256=upload.sha256,
+        size=upload.size,
+        filename=os.path.basename(upload.name)[:255] or 'file',
+        content_type=upload.content_type or 'application/octet-stream',
+        uploaded_by=uploaded_by,
+    )
+    target = attachment_root() / attachment.storage_name
+    upload.close()
+    if target.exists():
+        os.remove(upload.temporary_file_path())
+    else:
+        target.parent.mkdir(parents=True, exist_ok=True)
+        os.replace(upload.temporary_file_path(), target)
+    attachment.save()
+    return attachment
+
+
+def discard_uploads(files):
+    """Remove the temp files of uploads that weren't stored (stored ones are already moved)"""
+    for _, uploads in files.lists():
+        for upload in uploads:
+            if not isinstance(upload, HashedUploadedFile):
+                continue
+            upload.close()
+            try:
+                os.remove(upload.temporary_file_path())
+            except FileNotFoundError:
+                pass
+
+
+def parse_attachment_ids(value):
+    """
+    Validate a socket message's `attachments`: absent, or a list of at most
+    MAX_ATTACHMENTS_PER_MESSAGE positive integer ids. Raises ValueError.
+    """
+    if value is None:
+        return []
+    if not isinstance(value, list) or not all(
+        isinstance(i, int) and not isinstance(i, bool) and i > 0 for i in value
+    ):
+        raise ValueError('attachments must be a list of attachment ids')
+    if len(value) > MAX_ATTACHMENTS_PER_MESSAGE:
+        raise ValueError(f'A message can have at most {MAX_ATTACHMENTS_PER_MESSAGE} attachments')
+    return value
+
+
+def link_attachments(attachment_ids, user, **target):
+    """
+    Attach pending uploads to a saved message (target is message=... or
+    direct_message=...) and return their metadata. Ids that are unknown,
+    already used, or not uploaded by `user` are ignored; ids are sequential,
+    so uploads without an owner can't be claimed either.
+    """
+    ids = parse_attachment_ids(attachment_ids)
+    if not ids:
+        return []
+    attachments = list(
+        Attachment.objects.filter(
+            uploaded_by=user,
+            id__in=ids,
+            message__isnull=True,
+            direct_message__isnull=True,
+        )
+    )
+    Attachment.objects.filter(id__in=[a.id for a in attachments]).update(**target)
+    return [attachment_metadata(a) for a in attachments]
+
+
+def iter_file_range(path, start, length, chunk_size=64 * 1024):
+    with open(path, 'rb') as f:
+        f.seek(start)
+        while length > 0:
+            chunk = f.read(min(chunk_size, length))
+            if not chunk:
+                break
+            length -= len(chunk)
+            yield chunk
+
+
+def parse_range(header, size):
+    """
+    Parse a single-range `Range: bytes=...` header into (start, end) inclusive.
+    Returns None when the header should be ignored (absent, malformed or
+    multi-range) and raises ValueError when the range is unsatisfiable.
+    """
+    match = RANGE_RE.match(header or '')
+    if not match:
+        return None
+    first, last = match.groups()
+    if not first and not last:
+        return None
+    if not first:
+        # Suffix range: the last N bytes
+        length = int(last)
+        if length == 0:
+            raise ValueError('Unsatisfiable range')
+        return max(size - length, 0), size - 1
+    start = int(first)
+    end = min(int(last), size - 1) if last else size - 1
+    if start >= size or start > end:
+        raise ValueError('Unsatisfiable range')
+    return start, end
+
+
+def attachment_response(request, attachment):
+    """
+    Serve an attachment. In production nginx sends the file itself
+    (X-Accel-Redirect, with sendfile and Range support); otherwise Django
+    streams it and honours single byte ranges.
+    """
+    # Raster images open in the browser, everything else downloads
+    media_type = attachment.content_type.split(';')[0].strip().lower()
+    as_attachment = media_type not in INLINE_CONTENT_TYPES
+    content_disposition = content_disposition_header(as_attachment, attachment.filename)
+
+    if settings.ATTACHMENT_ACCEL_REDIRECT:
+        response = HttpResponse(content_type=attachment.content_type)
+        response['X-Accel-Redirect'] = settings.ATTACHMENT_ACCEL_REDIRECT + attachment.storage_name
+        response['Content-Disposition'] = content_disposition
+        return isolate(response)
+
+    path = attachment_root() / attachment.storage_name
+    try:
+        size = path.stat().st_size
+    except FileNotFoundError:
+        raise Http404('Attachment file is missing from storage')
+    try:
+        byte_range = parse_range(request.headers.get('Range'), size)
+    except ValueError:
+        response = HttpResponse(status=416)
+        response['Content-Range'] = f'bytes */{size}'
+        return response
+
+    if byte_range is None:
+        response = FileResponse(
+            open(path, 'rb'),
+            content_type=attachment.content_type,
+            as_attachment=as_attachment,
+            filename=attachment.filename,
+        )
+    else:
+        start, end = byte_range
+        response = StreamingHttpResponse(
+            iter_file_range(path, start, end - start + 1),
+            status=206,
+            content_type=attachment.content_type,
+        )
+        response['Content-Length'] = str(end - start + 1)
+        response['Content-Range'] = f'bytes {start}-{end}/{size}'
+        response['Content-Disposition'] = content_disposition
+    response['Accept-Ranges'] = 'bytes'
+    return isolate(response)
+
+
+def isolate(response):
+    """Uploaded content never runs as a page of the API origin, even if opened directly"""
+    response['Content-Security-Policy'] = 'sandbox'
+    response['X-Content-Type-Options'] = 'nosniff'
+    return response
@@ -0,0 +1,78 @@
+import asyncio
+import json
+import logging
+
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+
+class FrameBatchingMixin:
+    """
+    Opt-in (settings.CHAT_BATCH_FRAMES) coalescing of outgoing chat frames.
+
+    The first frame of a burst starts a CHAT_BATCH_MAX_DELAY_MS deadline;
+    frames queued before it passes go out together as one
+    {"type": "chat_batch", "messages": [...]} frame, or as soon as
+    CHAT_BATCH_MAX_SIZE are waiting. A lone frame is sent unchanged, so quiet
+    rooms see the same protocol as before.
+
+    The deadline is checked by a timer and again whenever another frame is
+    queued, but neither runs while the event loop is busy with other sockets,
+    so it is a target rather than a bound: under load a frame can wait
+    several times the delay (see benchmarks/batching.py).
+    """
+
+    pending_frames = None
+    flush_task = None
+    # Event loop time at which the oldest pending frame must be sent
+    flush_deadline = None
+
+    async def send_frame(self, frame):
+        if not settings.CHAT_BATCH_FRAMES:
+            await self.send(text_data=json.dumps(frame))
+            return
+
+        loop = asyncio.get_running_loop()
+        if not self.pending_frames:
+            self.pending_frames = []
+            self.flush_deadline = loop.time() + settings.CHAT_BATCH_MAX_DELAY_MS / 1000
+        self.pending_frames.append(frame)
+        if len(self.pending_frames) >= settings.CHAT_BATCH_MAX_SIZE or loop.time() >= self.flush_deadline:
+            await self.flush_frames()
+        elif self.flush_task is None:
+            # Handlers run one event at a time, so wait in a separate task
+            self.flush_task = asyncio.ensure_future(self.flush_later())
+
+    async def flush_later(self):
+        await asyncio.sleep(max(self.flush_deadline - asyncio.get_running_loop().time(), 0))
+        self.flush_task = None
+        try:
+            await self.flush_frames()
+        except Exception as e:
+            logger.warning("Could not send batched frames: %r", e)
+
+    async def flush_frames(self):
+        if self.flush_task is not None:
+            self.flush_task.cancel()
+            self.flush_task = None
+        frames, self.pending_frames = self.pending_frames, []
+        if not frames:
+            return
+        if len(frames) == 1:
+            await self.send(text_data=json.dumps(frames[0]))
+        else:
+            await self.send(text_data=json.dumps({"type": "chat_batch", "messages": frames}))
+
+    async def chat_batch(self, event):
+        """Messages posted together (bulk API); sent as one frame after anything queued"""
+        await self.flush_frames()
+        await self.send(text_data=json.dumps({"type": "chat_batch", "messages": event["messages"]}))
+
+    async def websocket_disconnect(self, message):
+        # The socket is gone; nothing left to flush to
+        if self.flush_task is not None:
+            self.flush_task.cancel()
+            self.flush_task = None
+        self.pending_frames = []
+        await super().websocket_disconnect(message)
@@ -0,0 +1,165 @@
+import hashlib
+import json
+import logging
+from datetime import timedelta
+
+from asgiref.sync import async_to_sync
+from channels.layers import get_channel_layer
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.db import IntegrityError, transaction
+from django.utils import timezone
+from rest_framework import status
+from rest_framework.exceptions import PermissionDenied
+from rest_framework.response import Response
+from .models import Message, DirectMessage, IdempotencyKey
+
+logger = logging.getLogger(__name__)
+
+
+# Lets bridges and importers set each item's `username`; everyone else posts as themselves
+POST_AS_OTHER_USERS = 'core.post_as_other_users'
+
+
+def check_authors(user, items):
+    """Refuse items written as someone else unless the user may post as other users"""
+    if any(item.get('username', user.username) != user.username for item in items) \
+            and not user.has_perm(POST_AS_OTHER_USERS):
+        raise PermissionDenied(f'Setting another author requires the {POST_AS_OTHER_USERS} permission')
+
+
+def resolve_users(usernames):
+    """Map usernames to users, creating the missing ones, in at most three queries"""
+    users = {user.username: user for user in User.objects.filter(username__in=usernames)}
+    missing = [name for name in usernames if name not in users]
+    if missing:
+        # Another request may create the same users concurrently
+        User.objects.bulk_create([User(username=name) for name in missing], ignore_conflicts=True)
+        users.update((user.username, user) for user in User.objects.filter(username__in=missing))
+    return users
+
+
+def broadcast_batch(group, frames):
+    """Send frames to a group as one chat_batch event (one channel-layer send per member)"""
+    try:
+        async_to_sync(get_channel_layer().group_send)(group, {"type": "chat_batch", "messages": frames})
+    except Exception:
+        # The rows are committed; clients still get them with their history
+        logger.exception("Bulk broadcast to %s failed", group, extra={'event': 'bulk_broadcast_error'})
+
+
+def post_room_messages(room, author, items):
+    """Insert a room's messages with one bulk_create and broadcast them after commit"""
+    users = resolve_users({item.get('username') or author.username for item in items})
+    messages = Message.objects.bulk_create([
+        Message(room=room, user=users[item.get('username') or author.username], content=item['message'])
+        for item in items
+    ])
+    frames = [
+        {
+            "type": "chat_message",
+            "message": message.content,
+            "username": message.user.username,
+            "timestamp": message.timestamp.isoformat(),
+            "attachments": []
+        }
+        for message in messages
+    ]
+    transaction.on_commit(lambda: broadcast_batch(f"chat_{room.name}", frames))
+    return {'room': room.id, 'created': len(messages), 'ids': [message.id for message in messages]}
+
+
+def post_direct_messages(author, items):
+    """Insert DMs with one bulk_create and broadcast one batch per conversation after commit"""
+    usernames = {item.get('username') or author.username for item in items}
+    usernames.update(item['recipient'] for item in items)
+    users = resolve_users(usernames)
+    messages = DirectMessage.objects.bulk_create([
+        DirectMessage(
+            sender=users[item.get('username') or author.username],
+            recipient=users[item['recipient']],
+            content=item['message']
+        )
+        for item in items
+    ])
+
+    conversations = {}
+    for dm in messages:
+        # Same group name as DirectMessageConsumer
+        first, second = sorted([dm.sender.username, dm.recipient.username])
+        conversations.setdefault(f"chat_dm_{first}_{second}", []).append({
+            "type": "chat_message",
+            "message": dm.content,
+            "username": dm.sender.username,
+            "timestamp": dm.timestamp.isoformat(),
+            "attachments": [],
+            "is_dm": True
+        })
+
+    def broadcast():
+        for group, frames in conversations.items():
+            broadcast_batch(group, frames)
+    transaction.on_commit(broadcast)
+    return {'created': len(messages), 'ids': [dm.id for dm in messages]}
+
+
+def idempotent_response(request, endpoint, payload, perform):
+    """
+    Run perform() in a transaction and return its data as a 201 response.
+
+    With an Idempotency-Key header, the response is stored together with
+    the key, in the same transaction, and a retry returns it again instead
+    of inserting twice. Reusing a key for a different payload is an error.
+    Keys expire after IDEMPOTENCY_KEY_RETENTION_HOURS.
+    """
+    key = request.headers.get('Idempotency-Key')
+    if not key:
+        with transaction.atomic():
+            return Response(perform(), status=status.HTTP_201_CREATED)
+    if len(key) > 255:
+        return Response({'error': 'Idempotency-Key is too long'}, status=status.HTTP_400_BAD_REQUEST)
+
+    request_hash = hashlib.sha256(json.dumps(payload, sort_keys=True).encode()).hexdigest()
+    lookup = {'user': request.user, 'endpoint': endpoint, 'key': key}
+    stored = IdempotencyKey.objects.filter(**lookup).first()
+    if stored is not None and stored.created_at < idempotency_cutoff():
+        # Expired but not purged yet; the key starts over
+        stored.delete()
+        stored = None
+    if stored is None:
+        try:
+            with transaction.atomic():
+                data = perform()
+                IdempotencyKey.objects.create(
+                    **lookup, request_hash=request_hash, status_code=status.HTTP_201_CREATED, response=data
+                )
+            return Response(data, status=status.HTTP_201_CREATED)
+        except IntegrityError:
+            # A concurrent request with the same key got there first
+            stored = IdempotencyKey.objects.filter(**lookup).first()
+            if stored is None:
+                raise
+
+    if stored.request_hash != request_hash:
+        return Response(
+            {'error': 'Idempotency-Key was already used for a different request'},
+            status=status.HTTP_422_UNPROCESSABLE_ENTITY
+        )
+    response = Response(stored.response, status=stored.status_code)
+    response['Idempotent-Replayed'] = 'true'
+    return response
+
+
+def idempotency_cutoff():
+    return timezone.now() - timedelta(hours=settings.IDEMPOTENCY_KEY_RETENTION_HOURS)
+
+
+def purge_idempotency_keys(batch_size=10000):
+    """Delete keys past the retention window, in batches so no one statement locks much; returns how many"""
+    cutoff = idempotency_cutoff()
+    purged = 0
+    while True:
+        ids = list(IdempotencyKey.objects.filter(created_at__lt=cutoff).values_list('id', flat=True)[:batch_size])
+        if not ids:
+            return purged
+        purged += IdempotencyKey.objects.filter(id__in=ids).delete()[0]
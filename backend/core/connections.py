@@ -0,0 +1,125 @@
+import asyncio
+import json
+import logging
+from collections import Counter
+
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+# Close codes sent to reaped sockets (4000-4999 are for applications)
+HEARTBEAT_TIMEOUT = 4000
+IDLE_TIMEOUT = 4001
+MAX_LIFETIME = 4002
+
+REASONS = {
+    HEARTBEAT_TIMEOUT: 'heartbeat',
+    IDLE_TIMEOUT: 'idle',
+    MAX_LIFETIME: 'lifetime',
+}
+
+
+class ConnectionReaper:
+    """
+    Process-wide heartbeat for WebSocket consumers.
+
+    One task wakes every WEBSOCKET_HEARTBEAT_INTERVAL seconds, pings every
+    registered socket ({"type": "ping"}, answered with {"type": "pong"}) and
+    closes the ones that are dead (nothing received within
+    WEBSOCKET_HEARTBEAT_TIMEOUT), idle (no chat traffic within
+    WEBSOCKET_IDLE_TIMEOUT) or older than WEBSOCKET_MAX_LIFETIME.
+    Closing them removes them from their groups, so messages stop being
+    fanned out to sockets nobody reads.
+    """
+
+    def __init__(self):
+        self.consumers = set()
+        self.reaped = Counter()
+        self.task = None
+
+    def register(self, consumer):
+        now = asyncio.get_running_loop().time()
+        consumer.connected_at = consumer.last_seen = consumer.last_active = now
+        self.consumers.add(consumer)
+        if self.task is None or self.task.done() or self.task.get_loop() is not asyncio.get_running_loop():
+            self.task = asyncio.ensure_future(self.run())
+
+    def unregister(self, consumer):
+        self.consumers.discard(consumer)
+
+    async def run(self):
+        while self.consumers:
+            await asyncio.sleep(settings.WEBSOCKET_HEARTBEAT_INTERVAL or 30)
+            try:
+                await self.sweep()
+            except Exception:
+                logger.exception("Connection sweep failed")
+
+    def expired(self, consumer, now):
+        """Close code for a socket that should be reaped, or None"""
+        if settings.WEBSOCKET_HEARTBEAT_INTERVAL and \
+                now - consumer.last_seen > settings.WEBSOCKET_HEARTBEAT_TIMEOUT:
+            return HEARTBEAT_TIMEOUT
+        if settings.WEBSOCKET_IDLE_TIMEOUT and now - consumer.last_active > settings.WEBSOCKET_IDLE_TIMEOUT:
+            return IDLE_TIMEOUT
+        if settings.WEBSOCKET_MAX_LIFETIME and now - consumer.connected_at > settings.WEBSOCKET_MAX_LIFETIME:
+            return MAX_LIFETIME
+        return None
+
+    async def sweep(self, now=None):
+        if now is None:
+            now = asyncio.get_running_loop().time()
+        calls = []
+        for consumer in list(self.consumers):
+            code = self.expired(consumer, now)
+            if code is not None:
+                calls.append(self.reap(consumer, code))
+            elif settings.WEBSOCKET_HEARTBEAT_INTERVAL:
+                calls.append(consumer.send(text_data='{"type": "ping"}'))
+        # A failed send means the socket is already going away
+        await asyncio.gather(*calls, return_exceptions=True)
+
+    async def reap(self, consumer, code):
+        self.unregister(consumer)
+        self.reaped[REASONS[code]] += 1
+        logger.info(
+            "Reaped %s connection", REASONS[code],
+            extra={'event': 'reaped', 'reason': REASONS[code], 'reaped_total': dict(self.reaped)}
+        )
+        await consumer.close(code=code)
+
+
+connection_reaper = ConnectionReaper()
+
+
+def is_pong(text):
+    # Cheap pre-check so chat messages aren't parsed twice
+    if not text or len(text) > 64 or 'pong' not in text:
+        return False
+    try:
+        return json.loads(text).get('type') == 'pong'
+    except (ValueError, AttributeError):
+        return False
+
+
+class HeartbeatMixin:
+    """
+    Registers accepted sockets with the connection reaper and tracks their
+    traffic. Pongs are consumed here and never reach receive().
+    """
+
+    async def accept(self, subprotocol=None):
+        await super().accept(subprotocol)
+        connection_reaper.register(self)
+
+    async def websocket_receive(self, message):
+        now = asyncio.get_running_loop().time()
+        self.last_seen = now
+        if is_pong(message.get('text')):
+            return
+        self.last_active = now
+        await super().websocket_receive(message)
+
+    async def websocket_disconnect(self, message):
+        connection_reaper.unregister(self)
+        await super().websocket_disconnect(message)
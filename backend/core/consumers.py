@@ -1,11 +1,21 @@
 import json
+import logging
 from channels.generic.websocket import AsyncWebsocketConsumer
 from channels.db import database_sync_to_async
+from django.conf import settings
 from django.contrib.auth.models import User
+from .attachments import attachment_metadata, link_attachments, parse_attachment_ids
+from .batching import FrameBatchingMixin
+from .connections import HeartbeatMixin
+from .fanout import local_fanout
+from .profiling import profiled
+from .replicas import pin_to_primary, replica_reads, scope_clients
 from .models import Room, Message
 
+logger = logging.getLogger(__name__)
 
-class ChatConsumer(AsyncWebsocketConsumer):
+
+class ChatConsumer(HeartbeatMixin, FrameBatchingMixin, AsyncWebsocketConsumer):
     """
     This consumer handles:
     - Connecting to a chat room
@@ -14,6 +24,7 @@ class ChatConsumer(AsyncWebsocketConsumer):
     - Saving messages to the database
     """
     
+    @profiled('ChatConsumer.connect')
     async def connect(self):
         """
         Called whenever a WebSocket client tries to connect.
@@ -34,11 +45,18 @@ class ChatConsumer(AsyncWebsocketConsumer):
         # Example: room1 → chat_room1
         self.room_group_name = f"chat_{self.room_name}"
 
+        # Who this socket reads for: its history skips replicas right after they wrote
+        self.replica_clients = scope_clients(self.scope)
+
         # Add this WebSocket connection to the group
-        await self.channel_layer.group_add(
-            self.room_group_name,
-            self.channel_name
-        )
+        # (in local fan-out mode the process subscribes once per room instead)
+        if settings.CHAT_LOCAL_FANOUT:
+            await local_fanout.join(self.room_group_name, self)
+        else:
+            await self.channel_layer.group_add(
+                self.room_group_name,
+                self.channel_name
+            )
 
         # Accept the WebSocket connection
         await self.accept()
@@ -52,7 +70,10 @@ class ChatConsumer(AsyncWebsocketConsumer):
             "messages": messages
         }))
 
-        print(f"User connected to: {self.room_name}")
+        logger.info(
+            "User connected to %s", self.room_name,
+            extra={"event": "connect", "room": self.room_name}
+        )
 
     
     async def disconnect(self, close_code):
@@ -61,19 +82,28 @@ class ChatConsumer(AsyncWebsocketConsumer):
         We simply remove the user from the room group.
         """
 
-        await self.channel_layer.group_discard(
-            self.room_group_name,
-            self.channel_name
-        )
+        if settings.CHAT_LOCAL_FANOUT:
+            await local_fanout.leave(self.room_group_name, self)
+        else:
+            await self.channel_layer.group_discard(
+                self.room_group_name,
+                self.channel_name
+            )
 
-        print(f"User disconnected from: {self.room_name}")
+        logger.info(
+            "User disconnected from %s", self.room_name,
+            extra={"event": "disconnect", "room": self.room_name, "close_code": close_code}
+        )
 
 
+    @profiled('ChatConsumer.receive')
     async def receive(self, text_data):
         """
         Called when WebSocket receives data from client.
         Example incoming JSON:
-            { "username": "Tilak", "message": "Hello!" }
+            { "username": "Tilak", "message": "Hello!", "attachments": [12] }
+        Files are uploaded through /api/attachments/ first; only their ids
+        travel over the socket.
         
         Steps:
         - Parse the JSON
@@ -85,13 +115,19 @@ class ChatConsumer(AsyncWebsocketConsumer):
             data = json.loads(text_data)
             message = data.get("message", "")
             username = data.get("username", "Anonymous")
+            try:
+                attachment_ids = parse_attachment_ids(data.get("attachments"))
+            except ValueError as e:
+                # Rejected before anything is saved
+                await self.send(text_data=json.dumps({"type": "error", "message": str(e)}))
+                return
 
             # Skip empty messages
-            if not message.strip():
+            if not message.strip() and not attachment_ids:
                 return
 
             # Save message using sync-to-async wrapper
-            saved_message = await self.save_message(username, message)
+            saved_message = await self.save_message(username, message, attachment_ids)
 
             # Send message to everyone in room
             await self.channel_layer.group_send(
@@ -100,26 +136,29 @@ class ChatConsumer(AsyncWebsocketConsumer):
                     "type": "chat_message",   # event handler
                     "message": saved_message["message"],
                     "username": saved_message["username"],
-                    "timestamp": saved_message["timestamp"]
+                    "timestamp": saved_message["timestamp"],
+                    "attachments": saved_message["attachments"]
                 }
             )
 
-        except Exception as e:
-            print("Receive error:", e)
+        except Exception:
+            logger.exception("Receive error", extra={"event": "receive_error", "room": self.room_name})
 
 
     async def chat_message(self, event):
         """
         Handles events sent to the group.
-        Whatever we broadcast above, this method receives and sends to the client.
+        Whatever we broadcast above, this method receives and sends to the client
+        (coalesced into chat_batch frames during bursts when batching is on).
         """
 
-        await self.send(text_data=json.dumps({
+        await self.send_frame({
             "type": "chat_message",
             "message": event["message"],
             "username": event["username"],
-            "timestamp": event["timestamp"]
-        }))
+            "timestamp": event["timestamp"],
+            "attachments": event.get("attachments", [])
+        })
 
 
     # ------------------------
@@ -127,7 +166,7 @@ class ChatConsumer(AsyncWebsocketConsumer):
     # ------------------------
 
     @database_sync_to_async
-    def save_message(self, username, message):
+    def save_message(self, username, message, attachment_ids=()):
         """
         Saves message to the database.
         Must run inside thread since Django ORM is sync.
@@ -147,16 +186,22 @@ class ChatConsumer(AsyncWebsocketConsumer):
                 content=message
             )
 
+            # Link previously uploaded files; only their metadata is broadcast
+            attachments = link_attachments(attachment_ids, user, message=msg)
+
+            pin_to_primary(*self.replica_clients, f'user:{username}')
+
             return {
                 "id": msg.id,
                 "username": msg.user.username,
                 "message": msg.content,
-                "timestamp": msg.timestamp.isoformat()
+                "timestamp": msg.timestamp.isoformat(),
+                "attachments": attachments
             }
 
-        except Exception as e:
-            print("DB save error:", e)
-            return {"username": username, "message": message, "timestamp": ""}
+        except Exception:
+            logger.exception("DB save error", extra={"event": "save_error", "room": self.room_name})
+            return {"username": username, "message": message, "timestamp": "", "attachments": []}
 
 
     @database_sync_to_async
@@ -167,20 +212,27 @@ class ChatConsumer(AsyncWebsocketConsumer):
         """
 
         try:
-            room = Room.objects.get(name=self.room_name)
-            messages = Message.objects.filter(room=room).order_by("timestamp")[:50]
-
-            return [
-                {
-                    "username": msg.user.username,
-                    "message": msg.content,
-                    "timestamp": msg.timestamp.isoformat()
-                }
-                for msg in messages
-            ]
+            with replica_reads(*self.replica_clients):
+                room = Room.objects.get(name=self.room_name)
+                messages = (
+                    Message.objects.filter(room=room)
+                    .select_related("user")
+                    .prefetch_related("attachments")
+                    .order_by("timestamp")[:50]
+                )
+
+                return [
+                    {
+                        "username": msg.user.username,
+                        "message": msg.content,
+                        "timestamp": msg.timestamp.isoformat(),
+                        "attachments": [attachment_metadata(a) for a in msg.attachments.all()]
+                    }
+                    for msg in messages
+                ]
 
         except Room.DoesNotExist:
             return []
-        except Exception as e:
-            print("DB fetch error:", e)
+        except Exception:
+            logger.exception("DB fetch error", extra={"event": "history_error", "room": self.room_name})
             return []
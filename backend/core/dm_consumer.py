@@ -1,16 +1,25 @@
 import json
+import logging
 from channels.generic.websocket import AsyncWebsocketConsumer
 from channels.db import database_sync_to_async
 from django.contrib.auth.models import User
+from .attachments import attachment_metadata, link_attachments, parse_attachment_ids
+from .batching import FrameBatchingMixin
+from .connections import HeartbeatMixin
 from .models import DirectMessage
+from .profiling import profiled
+from .replicas import pin_to_primary, replica_reads, scope_clients
 
+logger = logging.getLogger(__name__)
 
-class DirectMessageConsumer(AsyncWebsocketConsumer):
+
+class DirectMessageConsumer(HeartbeatMixin, FrameBatchingMixin, AsyncWebsocketConsumer):
     """
     Consumer for handling 1-on-1 direct messages between users.
     WebSocket URL: ws://localhost:8000/ws/dm/<recipient_username>/
     """
     
+    @profiled('DirectMessageConsumer.connect')
     async def connect(self):
         """
         Called when WebSocket connection is established.
@@ -29,6 +38,9 @@ class DirectMessageConsumer(AsyncWebsocketConsumer):
         self.room_name = f"dm_{users[0]}_{users[1]}"
         self.room_group_name = f"chat_{self.room_name}"
         
+        # History skips replicas right after this user wrote
+        self.replica_clients = scope_clients(self.scope)
+        
         # Add to channel group
         await self.channel_layer.group_add(
             self.room_group_name,
@@ -47,7 +59,10 @@ class DirectMessageConsumer(AsyncWebsocketConsumer):
             "messages": messages
         }))
         
-        print(f"DM connection: {self.current_username} <-> {self.recipient_username}")
+        logger.info(
+            "DM connection: %s <-> %s", self.current_username, self.recipient_username,
+            extra={"event": "connect", "room": self.room_name}
+        )
     
     
     async def disconnect(self, close_code):
@@ -56,9 +71,13 @@ class DirectMessageConsumer(AsyncWebsocketConsumer):
             self.room_group_name,
             self.channel_name
         )
-        print(f"DM disconnected: {self.current_username} <-> {self.recipient_username}")
+        logger.info(
+            "DM disconnected: %s <-> %s", self.current_username, self.recipient_username,
+            extra={"event": "disconnect", "room": self.room_name, "close_code": close_code}
+        )
     
     
+    @profiled('DirectMessageConsumer.receive')
     async def receive(self, text_data):
         """
         Receive message from WebSocket and broadcast to recipient
@@ -67,15 +86,22 @@ class DirectMessageConsumer(AsyncWebsocketConsumer):
             data = json.loads(text_data)
             message = data.get("message", "")
             sender_username = data.get("username", self.current_username)
+            try:
+                attachment_ids = parse_attachment_ids(data.get("attachments"))
+            except ValueError as e:
+                # Rejected before anything is saved
+                await self.send(text_data=json.dumps({"type": "error", "message": str(e)}))
+                return
             
-            if not message.strip():
+            if not message.strip() and not attachment_ids:
                 return
             
             # Save DM to database
             saved_message = await self.save_direct_message(
                 sender_username, 
                 self.recipient_username, 
-                message
+                message,
+                attachment_ids
             )
             
             # Broadcast to both users in the DM room
@@ -86,27 +112,29 @@ class DirectMessageConsumer(AsyncWebsocketConsumer):
                     "message": saved_message["message"],
                     "username": saved_message["username"],
                     "timestamp": saved_message["timestamp"],
+                    "attachments": saved_message["attachments"],
                     "is_dm": True
                 }
             )
             
-        except Exception as e:
-            print(f"DM receive error: {e}")
+        except Exception:
+            logger.exception("DM receive error", extra={"event": "receive_error", "room": self.room_name})
     
     
     async def chat_message(self, event):
-        """Send message to WebSocket"""
-        await self.send(text_data=json.dumps({
+        """Send message to WebSocket (batched during bursts when enabled)"""
+        await self.send_frame({
             "type": "chat_message",
             "message": event["message"],
             "username": event["username"],
             "timestamp": event["timestamp"],
+            "attachments": event.get("attachments", []),
             "is_dm": event.get("is_dm", True)
-        }))
+        })
     
     
     @database_sync_to_async
-    def save_direct_message(self, sender_username, recipient_username, message):
+    def save_direct_message(self, sender_username, recipient_username, message, attachment_ids=()):
         """Save direct message to database"""
         try:
             sender, _ = User.objects.get_or_create(username=sender_username)
@@ -118,18 +146,24 @@ class DirectMessageConsumer(AsyncWebsocketConsumer):
                 content=message
             )
             
+            attachments = link_attachments(attachment_ids, sender, direct_message=dm)
+            
+            pin_to_primary(*self.replica_clients, f'user:{sender_username}')
+            
             return {
                 "id": dm.id,
                 "username": dm.sender.username,
                 "message": dm.content,
-                "timestamp": dm.timestamp.isoformat()
+                "timestamp": dm.timestamp.isoformat(),
+                "attachments": attachments
             }
-        except Exception as e:
-            print(f"DB save error: {e}")
+        except Exception:
+            logger.exception("DB save error", extra={"event": "save_error", "room": self.room_name})
             return {
                 "username": sender_username, 
                 "message": message, 
-                "timestamp": ""
+                "timestamp": "",
+                "attachments": []
             }
     
     
@@ -137,21 +171,27 @@ class DirectMessageConsumer(AsyncWebsocketConsumer):
     def get_conversation_history(self):
         """Get last 50 messages between the two users"""
         try:
-            sender = User.objects.get(username=self.current_username)
-            recipient = User.objects.get(username=self.recipient_username)
-            
-            messages = DirectMessage.get_conversation(sender, recipient)[:50]
-            
-            return [
-                {
-                    "username": msg.sender.username,
-                    "message": msg.content,
-                    "timestamp": msg.timestamp.isoformat()
-                }
-                for msg in messages
-            ]
+            with replica_reads(*self.replica_clients):
+                sender = User.objects.get(username=self.current_username)
+                recipient = User.objects.get(username=self.recipient_username)
+                
+                messages = (
+                    DirectMessage.get_conversation(sender, recipient)
+                    .select_related("sender")
+                    .prefetch_related("attachments")[:50]
+                )
+                
+                return [
+                    {
+                        "username": msg.sender.username,
+                        "message": msg.content,
+                        "timestamp": msg.timestamp.isoformat(),
+                        "attachments": [attachment_metadata(a) for a in msg.attachments.all()]
+                    }
+                    for msg in messages
+                ]
         except User.DoesNotExist:
             return []
-        except Exception as e:
-            print(f"DB fetch error: {e}")
+        except Exception:
+            logger.exception("DB fetch error", extra={"event": "history_error", "room": self.room_name})
             return []
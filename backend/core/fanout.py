@@ -0,0 +1,155 @@
+import asyncio
+import logging
+import time
+
+logger = logging.getLogger(__name__)
+
+
+class Subscription:
+    """One channel-layer subscription shared by every local socket in a group"""
+
+    def __init__(self, channel_layer):
+        self.channel_layer = channel_layer
+        self.channel_name = None
+        self.consumers = set()
+        self.task = None
+        self.joined_at = 0.0
+        self.ready = asyncio.Event()
+        # Set when setting the subscription up failed; raised to every joiner
+        self.error = None
+
+
+class LocalFanout:
+    """
+    Process-wide registry that delivers group events to local consumers.
+
+    Instead of adding every socket's channel to `chat_<room>`, the process
+    adds a single channel per room it has sockets for and fans events out to
+    its consumers in memory. A group_send then costs the channel layer one
+    send per process rather than one per member.
+    """
+
+    # Re-add the process channel to its group this often; channels_redis
+    # drops group memberships after `group_expiry` (one day by default)
+    refresh_interval = 3600
+    # Wait after a failed receive, doubling up to max_retry_delay
+    retry_delay = 0.5
+    max_retry_delay = 30
+    # Give up on a socket's copy of an event after this many seconds, so one
+    # slow client can't hold up delivery to the rest of the room
+    delivery_timeout = 1
+
+    def __init__(self):
+        self.subscriptions = {}
+
+    async def join(self, group, consumer):
+        subscription = self.subscriptions.get(group)
+        if subscription is None:
+            subscription = Subscription(consumer.channel_layer)
+            self.subscriptions[group] = subscription
+            subscription.consumers.add(consumer)
+            try:
+                subscription.channel_name = await subscription.channel_layer.new_channel()
+                await self.subscribe(group, subscription)
+                subscription.task = asyncio.ensure_future(self.listen(group, subscription))
+            except Exception as e:
+                subscription.error = e
+                self.subscriptions.pop(group, None)
+                raise
+            finally:
+                subscription.ready.set()
+        else:
+            subscription.consumers.add(consumer)
+            # Another socket may still be setting the subscription up
+            await subscription.ready.wait()
+            if subscription.error is not None:
+                subscription.consumers.discard(consumer)
+                raise subscription.error
+
+    async def leave(self, group, consumer):
+        subscription = self.subscriptions.get(group)
+        if subscription is None:
+            return
+        subscription.consumers.discard(consumer)
+        if subscription.consumers:
+            return
+
+        del self.subscriptions[group]
+        await subscription.ready.wait()
+        if subscription.task is None:
+            return
+        subscription.task.cancel()
+        await subscription.channel_layer.group_discard(group, subscription.channel_name)
+
+    async def subscribe(self, group, subscription):
+        await subscription.channel_layer.group_add(group, subscription.channel_name)
+        subscription.joined_at = time.monotonic()
+
+    async def listen(self, group, subscription):
+        """
+        Receive the group's events once and hand them to every local socket.
+
+        Runs until leave() cancels it: the group membership is refreshed on a
+        timer, and after a channel-layer error (e.g. a Redis reconnect) it
+        backs off, re-adds the group and keeps receiving, since every local
+        socket in the group depends on this one task.
+        """
+        receive = None
+        delay = self.retry_delay
+        try:
+            while True:
+                if receive is None:
+                    receive = asyncio.ensure_future(subscription.channel_layer.receive(subscription.channel_name))
+                timeout = subscription.joined_at + self.refresh_interval - time.monotonic()
+                done, _ = await asyncio.wait({receive}, timeout=max(timeout, 0))
+                if not done:
+                    # Leave the pending receive running; only the membership is renewed
+                    await self.resubscribe(group, subscription)
+                    continue
+
+                task, receive = receive, None
+                try:
+                    event = task.result()
+                except Exception as e:
+                    logger.warning(
+                        "Local fan-out receive for %s failed, retrying in %.1fs: %r", group, delay, e,
+                        extra={'event': 'fanout_receive_error', 'group': group}
+                    )
+                    await asyncio.sleep(delay)
+                    delay = min(delay * 2, self.max_retry_delay)
+                    await self.resubscribe(group, subscription)
+                    continue
+                delay = self.retry_delay
+                await self.deliver(group, list(subscription.consumers), event)
+        finally:
+            if receive is not None:
+                receive.cancel()
+
+    async def resubscribe(self, group, subscription):
+        try:
+            await self.subscribe(group, subscription)
+        except Exception as e:
+            # Try again at the next refresh or error; don't spin on it meanwhile
+            subscription.joined_at = time.monotonic() - self.refresh_interval + self.max_retry_delay
+            logger.warning("Could not re-add %s to its group: %r", group, e)
+
+    async def deliver(self, group, consumers, event):
+        results = await asyncio.gather(
+            *(asyncio.wait_for(consumer.dispatch(event), self.delivery_timeout) for consumer in consumers),
+            return_exceptions=True
+        )
+        for result in results:
+            if isinstance(result, asyncio.TimeoutError):
+                logger.warning(
+                    "Local fan-out to %s dropped an event for a socket slower than %ss", group, self.delivery_timeout,
+                    extra={'event': 'fanout_slow_consumer', 'group': group}
+                )
+            elif isinstance(result, Exception):
+                logger.warning("Local fan-out to %s failed: %r", group, result)
+
+    def local_count(self, group):
+        subscription = self.subscriptions.get(group)
+        return len(subscription.consumers) if subscription else 0
+
+
+local_fanout = LocalFanout()
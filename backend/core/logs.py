@@ -0,0 +1,140 @@
+import atexit
+import json
+import logging
+import queue
+import random
+import sys
+import time
+from datetime import datetime, timezone
+from logging.handlers import QueueHandler, QueueListener
+
+# LogRecord attributes that aren't `extra=` fields
+RESERVED_ATTRS = set(vars(logging.makeLogRecord({}))) | {'message', 'asctime'}
+
+
+class JSONFormatter(logging.Formatter):
+    """One JSON object per line: time, level, logger, message and any extra= fields"""
+
+    def format(self, record):
+        entry = {
+            'time': datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec='milliseconds'),
+            'level': record.levelname,
+            'logger': record.name,
+            'message': record.getMessage(),
+        }
+        for key, value in vars(record).items():
+            if key not in RESERVED_ATTRS and not key.startswith('_'):
+                entry[key] = value
+        if record.exc_info and not record.exc_text:
+            record.exc_text = self.formatException(record.exc_info)
+        if record.exc_text:
+            entry['exception'] = record.exc_text
+        return json.dumps(entry, default=str)
+
+
+class SamplingFilter(logging.Filter):
+    """
+    Lets through a `rate` fraction of a logger's records below WARNING, for
+    events too frequent to log every time. Kept records carry `sample_rate`
+    so counts can be scaled back up.
+    """
+
+    def __init__(self, rate=1.0):
+        super().__init__()
+        self.rate = float(rate)
+
+    def filter(self, record):
+        if record.levelno >= logging.WARNING or self.rate >= 1:
+            return True
+        if random.random() >= self.rate:
+            return False
+        record.sample_rate = self.rate
+        return True
+
+
+class BlockingStopListener(QueueListener):
+    def enqueue_sentinel(self):
+        # Wait for room on shutdown instead of failing on a full queue
+        self.queue.put(self._sentinel)
+
+
+class BackgroundHandler(QueueHandler):
+    """
+    Hands records to a thread that formats and writes them, so logging from
+    the event loop never waits on stdout or a slow log driver.
+
+    The queue is bounded; when the writer falls that far behind, records are
+    dropped (and counted in `dropped`) rather than blocking the caller. How
+    many were lost is logged as a WARNING at most every `report_interval`
+    seconds, and on close.
+    """
+
+    def __init__(self, stream=None, queue_size=10000, report_interval=60):
+        super().__init__(queue.Queue(queue_size))
+        self.target = logging.StreamHandler(stream or sys.stderr)
+        self.dropped = 0
+        self.reported = 0
+        self.report_interval = report_interval
+        self.last_report = time.monotonic()
+        self.listener = BlockingStopListener(self.queue, self.target, respect_handler_level=False)
+        self.listener.start()
+        atexit.register(self.close)
+
+    def setFormatter(self, fmt):
+        # Formatting happens on the listener thread
+        self.target.setFormatter(fmt)
+
+    def prepare(self, record):
+        """
+        Make the record safe to hand to another thread: interpolate the
+        message now (its arguments may change later) and drop the traceback,
+        but leave the formatting to the listener.
+        """
+        record = logging.makeLogRecord(vars(record))
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+            return
+        if self.dropped > self.reported and time.monotonic() - self.last_report >= self.report_interval:
+            self.report_dropped()
+
+    def report_dropped(self, block=False):
+        """Queue a WARNING with the number of records dropped since the last one"""
+        count = self.dropped - self.reported
+        record = logging.makeLogRecord({
+            'name': __name__,
+            'levelno': logging.WARNING,
+            'levelname': 'WARNING',
+            'msg': f'Dropped {count} log records; the log writer is falling behind',
+            'event': 'logs_dropped',
+            'dropped': count,
+            'dropped_total': self.dropped,
+        })
+        try:
+            self.queue.put(record, block=block)
+        except queue.Full:
+            return
+        self.reported += count
+        self.last_report = time.monotonic()
+
+    def flush(self):
+        """Wait until the records queued so far are written"""
+        if self.listener._thread is not None:
+            self.queue.join()
+
+    def close(self):
+        if self.listener._thread is not None:
+            if self.dropped > self.reported:
+                self.report_dropped(block=True)
+            self.listener.stop()
+        self.target.close()
+        super().close()
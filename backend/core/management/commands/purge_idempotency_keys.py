@@ -0,0 +1,28 @@
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from core.bulk import purge_idempotency_keys
+
+
+class Command(BaseCommand):
+    help = (
+        'Delete bulk-post idempotency keys older than IDEMPOTENCY_KEY_RETENTION_HOURS. '
+        'Run it from cron, or keep it running with --follow.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=10000, help='Rows per DELETE')
+        parser.add_argument('--follow', action='store_true', help='Keep running, purging every --interval')
+        parser.add_argument('--interval', type=float, default=3600, help='Seconds between runs with --follow')
+
+    def handle(self, *args, **options):
+        while True:
+            purged = purge_idempotency_keys(options['batch_size'])
+            if purged or not options['follow']:
+                self.stdout.write(
+                    f'Purged {purged:,} idempotency keys older than {settings.IDEMPOTENCY_KEY_RETENTION_HOURS:g} hours'
+                )
+            if not options['follow']:
+                return
+            time.sleep(options['interval'])
@@ -0,0 +1,36 @@
+import time
+
+from django.core.management.base import BaseCommand
+from core.rollups import rebuild, roll_up_messages
+
+
+class Command(BaseCommand):
+    help = (
+        'Fold messages posted since the last run into the hourly room activity rollups '
+        'read by /api/rooms/<id>/stats/. Run it from cron, or keep it running with --follow.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=10000, help='Messages per transaction')
+        parser.add_argument('--follow', action='store_true', help='Keep running, catching up every --interval')
+        parser.add_argument('--interval', type=float, default=60, help='Seconds between runs with --follow')
+        parser.add_argument('--rebuild', action='store_true', help='Drop the rollups and start from the first message')
+
+    def handle(self, *args, **options):
+        if options['rebuild']:
+            rebuild()
+            self.stdout.write('Dropped existing rollups')
+
+        while True:
+            started = time.perf_counter()
+            total = 0
+            while True:
+                rows = roll_up_messages(options['batch_size'])
+                total += rows
+                if rows < options['batch_size']:
+                    break
+            if total or not options['follow']:
+                self.stdout.write(f'Rolled up {total:,} messages in {time.perf_counter() - started:.1f}s')
+            if not options['follow']:
+                return
+            time.sleep(options['interval'])
@@ -0,0 +1,265 @@
+import csv
+import io
+import itertools
+import random
+import time
+from contextlib import contextmanager
+from datetime import datetime, timedelta, timezone
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from core.models import Room, Message, DirectMessage
+
+USER_PREFIX = 'seed_user_'
+ROOM_PREFIX = 'seed-room-'
+
+WORDS = (
+    'the of and to a in is you that it he was for on are as with his they at be this have from '
+    'or one had by word but not what all were we when your can said there use an each which she '
+    'do how their if will up other about out many then them these so some her would make like '
+    'him into time has look two more write go see number no way could people my than first been '
+    'call who its now find long down day did get come made may part deploy release meeting lunch '
+    'bug review merge standup coffee weekend ticket build cache latency database redis postgres'
+).split()
+
+
+def zipf_cum_weights(n, exponent):
+    """Cumulative Zipf weights for ranks 1..n, for random.choices(cum_weights=...)"""
+    return list(itertools.accumulate(1 / rank ** exponent for rank in range(1, n + 1)))
+
+
+@contextmanager
+def explicit_timestamps(*fields):
+    """bulk_create would overwrite auto_now_add fields with the current time"""
+    for field in fields:
+        field.auto_now_add = False
+    try:
+        yield
+    finally:
+        for field in fields:
+            field.auto_now_add = True
+
+
+class RowWriter:
+    """
+    Inserts rows of one model in chunks: COPY on PostgreSQL, bulk_create
+    elsewhere. Rows are tuples in `fields` order.
+    """
+
+    def __init__(self, model, fields, chunk_size, use_copy):
+        self.model = model
+        self.fields = fields
+        self.chunk_size = chunk_size
+        self.use_copy = use_copy
+        self.columns = [model._meta.get_field(name).column for name in fields]
+        self.rows = 0
+        self.elapsed = 0.0
+
+    def write(self, rows, progress=None):
+        started = time.perf_counter()
+        iterator = iter(rows)
+        while True:
+            chunk = list(itertools.islice(iterator, self.chunk_size))
+            if not chunk:
+                break
+            with transaction.atomic():
+                if self.use_copy:
+                    self.copy(chunk)
+                else:
+                    self.model.objects.bulk_create(
+                        [self.model(**dict(zip(self.fields, row))) for row in chunk]
+                    )
+            self.rows += len(chunk)
+            if progress:
+                progress(self)
+        self.elapsed += time.perf_counter() - started
+
+    def copy(self, chunk):
+        buffer = io.StringIO()
+        writer = csv.writer(buffer)
+        for row in chunk:
+            writer.writerow([value.isoformat() if isinstance(value, datetime) else value for value in row])
+        buffer.seek(0)
+        with connection.cursor() as cursor:
+            cursor.cursor.copy_expert(
+                f'COPY {self.model._meta.db_table} ({", ".join(self.columns)}) FROM STDIN WITH (FORMAT csv)',
+                buffer
+            )
+
+    @property
+    def rate(self):
+        return self.rows / self.elapsed if self.elapsed else 0.0
+
+
+class Command(BaseCommand):
+    help = (
+        'Generate a large, deterministic chat dataset for benchmarking: '
+        'users, rooms with Zipf-distributed activity, messages and long DM threads'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--seed', type=int, default=0, help='Random seed; the same seed gives the same data')
+        parser.add_argument('--users', type=int, default=5000)
+        parser.add_argument('--rooms', type=int, default=2000)
+        parser.add_argument('--messages', type=int, default=1_000_000, help='Room messages')
+        parser.add_argument('--dm-threads', type=int, default=500, help='Pairs of users with a DM thread')
+        parser.add_argument('--dm-messages', type=int, default=250_000, help='Direct messages over all threads')
+        parser.add_argument(
+            '--zipf', type=float, default=1.1,
+            help='Zipf exponent of room, member and DM thread activity (higher = more skewed)'
+        )
+        parser.add_argument('--max-members', type=int, default=500, help='Members of the most popular room')
+        parser.add_argument('--days', type=int, default=365, help='Time span the messages are spread over')
+        parser.add_argument(
+            '--end', default='2025-01-01',
+            help='Timestamp of the last message (fixed so that runs are reproducible)'
+        )
+        parser.add_argument('--chunk-size', type=int, default=10000, help='Rows per insert')
+        parser.add_argument('--no-copy', action='store_true', help='Use bulk_create even on PostgreSQL')
+        parser.add_argument('--reset', action='store_true', help='Delete previously seeded users and rooms first')
+
+    def handle(self, *args, **options):
+        if min(options['users'], options['rooms'], options['chunk_size']) < 1 or options['users'] < 2:
+            raise CommandError('--users must be at least 2 and --rooms, --chunk-size at least 1')
+
+        self.options = options
+        self.rng = random.Random(options['seed'])
+        self.use_copy = connection.vendor == 'postgresql' and not options['no_copy']
+        self.end = datetime.fromisoformat(options['end']).replace(tzinfo=timezone.utc)
+        self.start = self.end - timedelta(days=options['days'])
+
+        if options['reset']:
+            self.reset()
+        elif User.objects.filter(username__startswith=USER_PREFIX).exists() or \
+                Room.objects.filter(name__startswith=ROOM_PREFIX).exists():
+            raise CommandError('Seeded data already exists; pass --reset to replace it')
+
+        self.stdout.write(
+            f"Seeding with seed={options['seed']} using {'COPY' if self.use_copy else 'bulk_create'}"
+        )
+        writers = []
+        with explicit_timestamps(Room._meta.get_field('created_at'),
+                                 Message._meta.get_field('timestamp'),
+                                 DirectMessage._meta.get_field('timestamp')):
+            user_ids = self.create_users(writers)
+            room_ids, members = self.create_rooms(user_ids, writers)
+            self.create_messages(room_ids, members, writers)
+            self.create_direct_messages(user_ids, writers)
+
+        if connection.vendor == 'postgresql':
+            # Fresh planner statistics, which the admin's estimated counts rely on
+            with connection.cursor() as cursor:
+                cursor.execute(f'ANALYZE {Message._meta.db_table}, {DirectMessage._meta.db_table}')
+
+        total_rows = sum(writer.rows for writer in writers)
+        total_time = sum(writer.elapsed for writer in writers)
+        self.stdout.write(self.style.SUCCESS(
+            f"Seeded {total_rows:,} rows in {total_time:.1f}s ({total_rows / max(total_time, 1e-9):,.0f} rows/s)"
+        ))
+
+    def reset(self):
+        started = time.perf_counter()
+        # Messages and DMs cascade from their users and rooms
+        Room.objects.filter(name__startswith=ROOM_PREFIX).delete()
+        User.objects.filter(username__startswith=USER_PREFIX).delete()
+        self.stdout.write(f'Removed previously seeded data in {time.perf_counter() - started:.1f}s')
+
+    def run_writer(self, writers, label, model, fields, rows, copy=True):
+        writer = RowWriter(model, fields, self.options['chunk_size'], self.use_copy and copy)
+        writers.append(writer)
+        progress = None
+        if self.options['verbosity'] > 1:
+            progress = lambda w: self.stdout.write(f'  {label}: {w.rows:,} rows')  # noqa: E731
+        writer.write(rows, progress)
+        self.stdout.write(
+            f'{label}: {writer.rows:,} rows in {writer.elapsed:.1f}s ({writer.rate:,.0f} rows/s)'
+        )
+        return writer
+
+    def create_users(self, writers):
+        count = self.options['users']
+        width = len(str(count))
+        rows = (
+            (f'{USER_PREFIX}{i:0{width}d}', '!', self.start)
+            for i in range(count)
+        )
+        # bulk_create fills in the other columns from the model defaults
+        self.run_writer(writers, 'Users', User, ('username', 'password', 'date_joined'), rows, copy=False)
+        return list(
+            User.objects.filter(username__startswith=USER_PREFIX).order_by('username').values_list('id', flat=True)
+        )
+
+    def create_rooms(self, user_ids, writers):
+        """Rooms get popularity ranks; popular rooms have more members and more messages"""
+        count = self.options['rooms']
+        width = len(str(count))
+        rows = (
+            (f'{ROOM_PREFIX}{i:0{width}d}', f'Seeded room {i}', self.start - timedelta(days=1))
+            for i in range(count)
+        )
+        self.run_writer(writers, 'Rooms', Room, ('name', 'description', 'created_at'), rows, copy=False)
+        room_ids = list(
+            Room.objects.filter(name__startswith=ROOM_PREFIX).order_by('name').values_list('id', flat=True)
+        )
+        # Rank order is random so that popularity doesn't follow the ids
+        self.rng.shuffle(room_ids)
+
+        exponent = self.options['zipf']
+        max_members = min(self.options['max_members'], len(user_ids))
+        members = []
+        for rank, room_id in enumerate(room_ids, start=1):
+            size = max(2, int(max_members / rank ** exponent))
+            members.append(self.rng.sample(user_ids, min(size, len(user_ids))))
+
+        Membership = Room.members.through
+        rows = ((room_id, user_id) for room_id, room_members in zip(room_ids, members) for user_id in room_members)
+        self.run_writer(writers, 'Room members', Membership, ('room_id', 'user_id'), rows)
+        return room_ids, members
+
+    def timestamps(self, count):
+        """`count` increasing timestamps spread over the configured span"""
+        step = (self.end - self.start) / max(count, 1)
+        for i in range(count):
+            yield self.start + step * (i + self.rng.random() * 0.5)
+
+    def content(self):
+        return ' '.join(self.rng.choices(WORDS, k=self.rng.randint(1, 30)))
+
+    def create_messages(self, room_ids, members, writers):
+        cum_weights = zipf_cum_weights(len(room_ids), self.options['zipf'])
+        ranks = range(len(room_ids))
+        rng = self.rng
+
+        def rows():
+            for timestamp in self.timestamps(self.options['messages']):
+                rank = rng.choices(ranks, cum_weights=cum_weights)[0]
+                yield room_ids[rank], rng.choice(members[rank]), self.content(), timestamp
+
+        self.run_writer(writers, 'Messages', Message, ('room_id', 'user_id', 'content', 'timestamp'), rows())
+
+    def create_direct_messages(self, user_ids, writers):
+        """A few very long threads and many short ones"""
+        thread_count = self.options['dm_threads']
+        if not thread_count or not self.options['dm_messages']:
+            return
+        rng = self.rng
+        pairs = set()
+        max_pairs = len(user_ids) * (len(user_ids) - 1) // 2
+        while len(pairs) < min(thread_count, max_pairs):
+            pairs.add(tuple(sorted(rng.sample(user_ids, 2))))
+        threads = sorted(pairs)
+        rng.shuffle(threads)
+        cum_weights = zipf_cum_weights(len(threads), self.options['zipf'])
+        read_until = self.end - timedelta(days=1)
+
+        def rows():
+            for timestamp in self.timestamps(self.options['dm_messages']):
+                pair = rng.choices(threads, cum_weights=cum_weights)[0]
+                sender, recipient = pair if rng.random() < 0.5 else pair[::-1]
+                yield sender, recipient, self.content(), timestamp, timestamp < read_until
+
+        self.run_writer(
+            writers, 'Direct messages', DirectMessage,
+            ('sender_id', 'recipient_id', 'content', 'timestamp', 'is_read'), rows()
+        )
@@ -0,0 +1,208 @@
+import multiprocessing
+import os
+import signal
+import socket
+import time
+from multiprocessing.connection import wait
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+
+def bind_socket(host, port, reuse_port):
+    """
+    Create a listening TCP socket.
+    With reuse_port every worker binds its own socket to the same port and the
+    kernel load-balances new connections between them.
+    """
+    family = socket.AF_INET6 if ':' in host else socket.AF_INET
+    sock = socket.socket(family, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    if reuse_port:
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+    sock.bind((host, port))
+    sock.listen(1024)
+    sock.set_inheritable(True)
+    return sock
+
+
+def run_worker(worker_id, host, port, shared_socket, options):
+    """
+    Entry point of a worker process: a single Daphne server on the shared port.
+    Runs in a freshly spawned interpreter so no event loop or DB connection
+    is shared with the supervisor.
+    """
+    import django
+    django.setup()
+
+    # Per-process connection budget, read by ConnectionLimitMiddleware
+    settings.WEBSOCKET_MAX_CONNECTIONS = options['max_connections']
+
+    from daphne.server import Server
+    from twisted.internet import reactor
+    from daphne.management.commands.runserver import get_default_application
+
+    sock = shared_socket or bind_socket(host, port, reuse_port=True)
+    sock.setblocking(False)
+
+    class WorkerServer(Server):
+        """Daphne server on an already-bound socket that can drain on shutdown"""
+
+        def run(self):
+            # Twisted's strports can't adopt a socket, so listen on it directly
+            self.endpoints = []
+            self.ports = []
+            reactor.callWhenRunning(self.adopt_socket)
+            super().run()
+
+        def adopt_socket(self):
+            port = reactor.adoptStreamPort(sock.fileno(), sock.family, self.http_factory)
+            self.ports.append(port)
+            self.listen_success(port)
+
+        def drain(self, timeout):
+            for listening_port in self.ports:
+                listening_port.stopListening()
+            # adoptStreamPort listens on a dup; close ours so the kernel stops
+            # routing new connections to this process
+            sock.close()
+            # Ask WebSocket clients to reconnect elsewhere (1001 Going Away);
+            # in-flight HTTP requests are left to finish
+            for protocol, details in list(self.connections.items()):
+                if 'disconnected' not in details and hasattr(protocol, 'serverClose'):
+                    protocol.serverClose(code=1001)
+            self.wait_for_drain(time.monotonic() + timeout)
+
+        def wait_for_drain(self, deadline):
+            open_connections = [
+                details for details in self.connections.values()
+                if 'disconnected' not in details
+            ]
+            if not open_connections or time.monotonic() >= deadline:
+                self.stop()
+            else:
+                reactor.callLater(0.1, self.wait_for_drain, deadline)
+
+    server = WorkerServer(
+        application=get_default_application(),
+        endpoints=[f"fd:fileno={sock.fileno()}"],
+        signal_handlers=False,
+        websocket_timeout=options['websocket_timeout'],
+        verbosity=options['verbosity'],
+        server_name='daphne',
+    )
+
+    def handle_term(signum, frame):
+        reactor.callFromThread(server.drain, options['drain_timeout'])
+
+    signal.signal(signal.SIGTERM, handle_term)
+    # Ctrl+C reaches the whole process group; let the supervisor coordinate
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    server.run()
+
+
+class Command(BaseCommand):
+    help = 'Run several Daphne worker processes that share one port (SO_REUSEPORT)'
+
+    # Don't restart a worker more than once per this many seconds
+    restart_delay = 1.0
+
+    def add_arguments(self, parser):
+        parser.add_argument('-b', '--bind', default='0.0.0.0', help='Address to bind to')
+        parser.add_argument('-p', '--port', type=int, default=9000, help='Port to bind to')
+        parser.add_argument(
+            '-w', '--workers', type=int,
+            default=int(os.environ.get('WEB_CONCURRENCY') or 0) or os.cpu_count() or 1,
+            help='Number of worker processes (default: $WEB_CONCURRENCY or CPU count)'
+        )
+        parser.add_argument(
+            '--max-connections', type=int,
+            default=getattr(settings, 'WEBSOCKET_MAX_CONNECTIONS', 0),
+            help='WebSocket connection budget of each worker (0 = unlimited)'
+        )
+        parser.add_argument(
+            '--drain-timeout', type=float, default=30,
+            help='Seconds a worker waits for connections to close after SIGTERM'
+        )
+        parser.add_argument(
+            '--websocket-timeout', type=int, default=86400,
+            help='Maximum lifetime of a WebSocket connection in seconds'
+        )
+
+    def handle(self, *args, **options):
+        if options['workers'] < 1:
+            raise CommandError('--workers must be at least 1')
+
+        host, port = options['bind'], options['port']
+        # Without SO_REUSEPORT, fall back to pre-forking around one shared socket
+        self.shared_socket = None
+        if not hasattr(socket, 'SO_REUSEPORT'):
+            self.shared_socket = bind_socket(host, port, reuse_port=False)
+
+        self.context = multiprocessing.get_context('spawn')
+        self.worker_args = (host, port, self.shared_socket, {
+            'max_connections': options['max_connections'],
+            'drain_timeout': options['drain_timeout'],
+            'websocket_timeout': options['websocket_timeout'],
+            'verbosity': options['verbosity'],
+        })
+        self.workers = {}
+        self.stopping = False
+
+        signal.signal(signal.SIGTERM, self.handle_stop)
+        signal.signal(signal.SIGINT, self.handle_stop)
+
+        for worker_id in range(options['workers']):
+            self.start_worker(worker_id)
+        self.stdout.write(
+            f"Serving on {host}:{port} with {options['workers']} workers "
+            f"({'shared socket' if self.shared_socket else 'SO_REUSEPORT'})"
+        )
+
+        self.supervise()
+        self.shutdown(options['drain_timeout'])
+
+    def start_worker(self, worker_id):
+        process = self.context.Process(
+            target=run_worker,
+            args=(worker_id, *self.worker_args),
+            name=f'chat-worker-{worker_id}',
+            daemon=False,
+        )
+        process.start()
+        self.workers[worker_id] = (process, time.monotonic())
+
+    def supervise(self):
+        """Restart workers that exit until we are asked to stop"""
+        while not self.stopping:
+            sentinels = {process.sentinel: worker_id for worker_id, (process, _) in self.workers.items()}
+            for sentinel in wait(list(sentinels), timeout=1.0):
+                if self.stopping:
+                    break
+                worker_id = sentinels[sentinel]
+                process, started = self.workers[worker_id]
+                process.join()
+                self.stderr.write(
+                    f"Worker {worker_id} (pid {process.pid}) exited with code {process.exitcode}, restarting"
+                )
+                # Avoid a hot restart loop when a worker crashes on startup
+                time.sleep(max(0.0, self.restart_delay - (time.monotonic() - started)))
+                self.start_worker(worker_id)
+
+    def shutdown(self, drain_timeout):
+        """Drain every worker, then kill the ones that don't exit in time"""
+        for process, _ in self.workers.values():
+            if process.is_alive():
+                os.kill(process.pid, signal.SIGTERM)
+        deadline = time.monotonic() + drain_timeout + 5
+        for process, _ in self.workers.values():
+            process.join(max(0.0, deadline - time.monotonic()))
+            if process.is_alive():
+                process.kill()
+                process.join()
+        if self.shared_socket:
+            self.shared_socket.close()
+        self.stdout.write('All workers stopped')
+
+    def handle_stop(self, signum, frame):
+        self.stopping = True
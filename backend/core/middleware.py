@@ -0,0 +1,62 @@
+import json
+import logging
+import random
+
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+
+class ConnectionLimitMiddleware:
+    """
+    ASGI middleware that caps the number of open WebSockets in this process.
+
+    Each worker started by `manage.py serve` gets its own budget
+    (settings.WEBSOCKET_MAX_CONNECTIONS). Once it is used up, new sockets get
+    a {"type": "retry", "retry_after": seconds} frame and close code 1013
+    (Try Again Later) so the client can reconnect, likely to a less busy
+    process. 0 disables the limit.
+    """
+
+    def __init__(self, inner, max_connections=None):
+        self.inner = inner
+        self.max_connections = max_connections
+        self.active_connections = 0
+        self.rejected = 0
+
+    def get_max_connections(self):
+        if self.max_connections is not None:
+            return self.max_connections
+        return getattr(settings, 'WEBSOCKET_MAX_CONNECTIONS', 0)
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] != 'websocket':
+            return await self.inner(scope, receive, send)
+
+        max_connections = self.get_max_connections()
+        if max_connections and self.active_connections >= max_connections:
+            await self.reject(receive, send)
+            return
+
+        self.active_connections += 1
+        try:
+            return await self.inner(scope, receive, send)
+        finally:
+            self.active_connections -= 1
+
+    async def reject(self, receive, send):
+        """
+        Accept just long enough to send the retry hint: a refused handshake
+        reaches browsers as a bare failure without code or reason.
+        """
+        await receive()
+        self.rejected += 1
+        # Jittered so that a reconnect storm doesn't come back all at once
+        retry_after = round(settings.WEBSOCKET_RETRY_AFTER * (1 + random.random()), 1)
+        await send({'type': 'websocket.accept'})
+        await send({'type': 'websocket.send', 'text': json.dumps({'type': 'retry', 'retry_after': retry_after})})
+        await send({'type': 'websocket.close', 'code': 1013})
+        logger.info(
+            "Rejected WebSocket over the connection limit",
+            extra={'event': 'rejected', 'rejected_total': self.rejected, 'retry_after': retry_after}
+        )
@@ -0,0 +1,61 @@
+# Generated by Django 4.2.7 on 2026-10-19 19:36
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('core', '0004_idempotencykey'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='RollupWatermark',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=100, unique=True)),
+                ('last_id', models.BigIntegerField(default=0)),
+                ('last_timestamp', models.DateTimeField(blank=True, null=True)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='RoomActivitySender',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('bucket', models.DateTimeField()),
+                ('message_count', models.PositiveIntegerField(default=0)),
+                ('room', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='activity_senders', to='core.room')),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'ordering': ['bucket'],
+            },
+        ),
+        migrations.CreateModel(
+            name='RoomActivity',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('bucket', models.DateTimeField()),
+                ('message_count', models.PositiveIntegerField(default=0)),
+                ('sender_count', models.PositiveIntegerField(default=0)),
+                ('room', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='activity', to='core.room')),
+            ],
+            options={
+                'verbose_name_plural': 'room activity',
+                'ordering': ['bucket'],
+            },
+        ),
+        migrations.AddConstraint(
+            model_name='roomactivitysender',
+            constraint=models.UniqueConstraint(fields=('room', 'bucket', 'user'), name='unique_room_activity_sender'),
+        ),
+        migrations.AddConstraint(
+            model_name='roomactivity',
+            constraint=models.UniqueConstraint(fields=('room', 'bucket'), name='unique_room_activity_bucket'),
+        ),
+    ]
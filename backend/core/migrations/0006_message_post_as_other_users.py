@@ -0,0 +1,17 @@
+# Generated by Django 4.2.7 on 2026-10-19 19:46
+
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0005_activity_rollups'),
+    ]
+
+    operations = [
+        migrations.AlterModelOptions(
+            name='message',
+            options={'ordering': ['timestamp'], 'permissions': [('post_as_other_users', 'Can set another author on bulk-posted messages')]},
+        ),
+    ]
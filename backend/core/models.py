@@ -1,8 +1,40 @@
 
 from django.db import models
+from django.db.models.functions import Coalesce
 from django.contrib.auth.models import User
 
 
+class RoomQuerySet(models.QuerySet):
+    
+    def with_stats(self):
+        """
+        Annotate message/member counts and the latest message in the same
+        query, so listing rooms doesn't cost extra queries per room.
+        """
+        room_messages = Message.objects.filter(room=models.OuterRef('pk')).order_by()
+        last_message = room_messages.order_by('-timestamp', '-id')
+        return self.annotate(
+            message_total=Coalesce(
+                models.Subquery(
+                    room_messages.values('room').annotate(count=models.Count('*')).values('count'),
+                    output_field=models.IntegerField()
+                ),
+                0
+            ),
+            member_total=Coalesce(
+                models.Subquery(
+                    Room.members.through.objects.filter(room=models.OuterRef('pk')).order_by()
+                    .values('room').annotate(count=models.Count('*')).values('count'),
+                    output_field=models.IntegerField()
+                ),
+                0
+            ),
+            last_message_username=models.Subquery(last_message.values('user__username')[:1]),
+            last_message_content=models.Subquery(last_message.values('content')[:1]),
+            last_message_timestamp=models.Subquery(last_message.values('timestamp')[:1]),
+        )
+
+
 class Room(models.Model):
     """Chat room model for group conversations"""
     name = models.CharField(max_length=255, unique=True)
@@ -10,6 +42,8 @@ class Room(models.Model):
     created_at = models.DateTimeField(auto_now_add=True)
     members = models.ManyToManyField(User, related_name='chat_rooms', blank=True)
     
+    objects = RoomQuerySet.as_manager()
+    
     class Meta:
         ordering = ['-created_at']
     
@@ -30,6 +64,9 @@ class Message(models.Model):
     
     class Meta:
         ordering = ['timestamp']
+        permissions = [
+            ('post_as_other_users', 'Can set another author on bulk-posted messages'),
+        ]
     
     def __str__(self):
         return f'{self.user.username}: {self.content[:50]}'
@@ -59,3 +96,92 @@ class DirectMessage(models.Model):
             models.Q(sender=user1, recipient=user2) | 
             models.Q(sender=user2, recipient=user1)
         ).order_by('timestamp')
+
+
+class Attachment(models.Model):
+    """File attached to a group or direct message, stored on disk by content hash"""
+    sha256 = models.CharField(max_length=64, db_index=True)
+    size = models.BigIntegerField()
+    filename = models.CharField(max_length=255)
+    content_type = models.CharField(max_length=255)
+    uploaded_by = models.ForeignKey(User, on_delete=models.SET_NULL, null=True, blank=True, related_name='attachments')
+    message = models.ForeignKey(Message, on_delete=models.CASCADE, null=True, blank=True, related_name='attachments')
+    direct_message = models.ForeignKey(DirectMessage, on_delete=models.CASCADE, null=True, blank=True, related_name='attachments')
+    created_at = models.DateTimeField(auto_now_add=True)
+    
+    class Meta:
+        ordering = ['id']
+    
+    def __str__(self):
+        return f'{self.filename} ({self.sha256[:12]})'
+    
+    @property
+    def storage_name(self):
+        """Path relative to ATTACHMENT_ROOT, shared by every upload with the same content"""
+        return f'{self.sha256[:2]}/{self.sha256[2:4]}/{self.sha256}'
+
+
+class IdempotencyKey(models.Model):
+    """Stored response of a bulk request, replayed when a client retries with the same Idempotency-Key"""
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='idempotency_keys')
+    endpoint = models.CharField(max_length=100)
+    key = models.CharField(max_length=255)
+    request_hash = models.CharField(max_length=64)
+    status_code = models.PositiveSmallIntegerField()
+    response = models.JSONField()
+    # Indexed for the retention purge (IDEMPOTENCY_KEY_RETENTION_HOURS)
+    created_at = models.DateTimeField(auto_now_add=True, db_index=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['user', 'endpoint', 'key'], name='unique_idempotency_key'),
+        ]
+
+    def __str__(self):
+        return f'{self.endpoint} {self.key}'
+
+
+class RoomActivity(models.Model):
+    """Messages and distinct senders per room per hour, maintained by core.rollups"""
+    room = models.ForeignKey(Room, on_delete=models.CASCADE, related_name='activity')
+    bucket = models.DateTimeField()
+    message_count = models.PositiveIntegerField(default=0)
+    sender_count = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        ordering = ['bucket']
+        verbose_name_plural = 'room activity'
+        constraints = [
+            models.UniqueConstraint(fields=['room', 'bucket'], name='unique_room_activity_bucket'),
+        ]
+
+    def __str__(self):
+        return f'{self.room_id} @ {self.bucket:%Y-%m-%d %H:00}: {self.message_count}'
+
+
+class RoomActivitySender(models.Model):
+    """Messages per user per room per hour; distinct senders over any range come from here"""
+    room = models.ForeignKey(Room, on_delete=models.CASCADE, related_name='activity_senders')
+    bucket = models.DateTimeField()
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='+')
+    message_count = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        ordering = ['bucket']
+        constraints = [
+            models.UniqueConstraint(fields=['room', 'bucket', 'user'], name='unique_room_activity_sender'),
+        ]
+
+    def __str__(self):
+        return f'{self.room_id} @ {self.bucket:%Y-%m-%d %H:00} {self.user_id}: {self.message_count}'
+
+
+class RollupWatermark(models.Model):
+    """Last row a rollup has folded in; the next run starts after it"""
+    name = models.CharField(max_length=100, unique=True)
+    last_id = models.BigIntegerField(default=0)
+    last_timestamp = models.DateTimeField(null=True, blank=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f'{self.name}: {self.last_id}'
@@ -0,0 +1,47 @@
+from django.core.paginator import Paginator
+from django.db import connections
+from django.utils.functional import cached_property
+
+
+class EstimatedCountPaginator(Paginator):
+    """
+    Paginator that avoids an exact COUNT(*) on very large tables.
+
+    For an unfiltered queryset on PostgreSQL, the row count comes from the
+    planner's statistics in pg_class (kept fresh by autovacuum/ANALYZE).
+    Filtered querysets, small tables and other databases fall back to the
+    regular exact count.
+    """
+
+    # Below this many (estimated) rows an exact count is cheap enough
+    exact_count_threshold = 10000
+
+    @cached_property
+    def count(self):
+        estimate = self.estimated_count()
+        if estimate is None or estimate < self.exact_count_threshold:
+            return super().count
+        return estimate
+
+    def estimated_count(self):
+        """Return the planner's row estimate, or None if it can't be used."""
+        queryset = self.object_list
+        query = getattr(queryset, 'query', None)
+        if query is None or query.where or query.distinct or query.is_sliced:
+            return None
+
+        connection = connections[queryset.db]
+        if connection.vendor != 'postgresql':
+            return None
+
+        with connection.cursor() as cursor:
+            cursor.execute(
+                "SELECT reltuples::bigint FROM pg_class WHERE relname = %s",
+                [queryset.model._meta.db_table]
+            )
+            row = cursor.fetchone()
+
+        # reltuples is -1 (or 0) for tables that were never analyzed
+        if not row or row[0] is None or row[0] <= 0:
+            return None
+        return int(row[0])
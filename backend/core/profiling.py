@@ -0,0 +1,140 @@
+import cProfile
+import functools
+import logging
+import os
+import random
+import threading
+import time
+from contextvars import ContextVar
+
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+# The operation (consumer call or API request) whose queries are being counted
+current_operation = ContextVar('current_operation', default=None)
+
+# cProfile can only have one active profiler per thread
+_active = threading.local()
+
+
+def profiling_enabled():
+    return settings.PROFILING_SAMPLE_RATE > 0 or settings.PROFILING_SLOW_MS > 0
+
+
+def record_query(execute, sql, params, many, context):
+    """
+    Database execute wrapper installed on every connection.
+    Only does work while an operation is being measured; the context variable
+    follows the call into database_sync_to_async threads.
+    """
+    operation = current_operation.get()
+    if operation is None:
+        return execute(sql, params, many, context)
+    started = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        operation.record_query(sql, time.perf_counter() - started)
+
+
+def install_query_recorder(sender, connection, **kwargs):
+    """connection_created receiver that adds record_query to new connections"""
+    if record_query not in connection.execute_wrappers:
+        connection.execute_wrappers.append(record_query)
+
+
+class Operation:
+    """
+    Measures one call: wall time and SQL queries always, and a cProfile
+    of a sampled fraction of calls.
+
+    In consumers the profile covers everything that ran on the event loop
+    while the call was awaiting, not just this call's own frames.
+    """
+
+    def __init__(self, name):
+        self.name = name
+        self.queries = 0
+        self.sql_time = 0.0
+        self.profiler = None
+
+    def record_query(self, sql, duration):
+        self.queries += 1
+        self.sql_time += duration
+
+    def __enter__(self):
+        if random.random() < settings.PROFILING_SAMPLE_RATE and not getattr(_active, 'profiling', False):
+            _active.profiling = True
+            self.profiler = cProfile.Profile()
+            self.profiler.enable()
+        self.token = current_operation.set(self)
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        duration = time.perf_counter() - self.started
+        current_operation.reset(self.token)
+        if self.profiler is not None:
+            self.profiler.disable()
+            _active.profiling = False
+            self.dump(duration)
+
+        if settings.PROFILING_SLOW_MS and duration * 1000 >= settings.PROFILING_SLOW_MS:
+            logger.warning(
+                "Slow operation %s: %.1fms, %d queries in %.1fms",
+                self.name, duration * 1000, self.queries, self.sql_time * 1000,
+                extra={
+                    'operation': self.name,
+                    'duration_ms': round(duration * 1000, 1),
+                    'queries': self.queries,
+                    'sql_ms': round(self.sql_time * 1000, 1),
+                }
+            )
+        return False
+
+    def dump(self, duration):
+        """Write the profile as a pstats file (python -m pstats, snakeviz, ...)"""
+        directory = settings.PROFILING_DIR
+        os.makedirs(directory, exist_ok=True)
+        filename = '{}-{}-{}-{:.0f}ms.prof'.format(
+            self.name.replace(' ', '_').replace('/', '_'),
+            time.strftime('%Y%m%dT%H%M%S'),
+            os.getpid(),
+            duration * 1000,
+        )
+        try:
+            self.profiler.dump_stats(os.path.join(directory, filename))
+        except OSError as e:
+            logger.error("Could not write profile %s: %s", filename, e)
+
+
+def profiled(name):
+    """
+    Decorator for async consumer handlers. When profiling is disabled this
+    costs two settings lookups per call.
+    """
+    def decorator(func):
+        @functools.wraps(func)
+        async def wrapper(*args, **kwargs):
+            if not profiling_enabled():
+                return await func(*args, **kwargs)
+            with Operation(name):
+                return await func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+class ProfiledViewMixin:
+    """Measures DRF requests as `<ViewSet>.<action>` operations"""
+
+    def dispatch(self, request, *args, **kwargs):
+        if not profiling_enabled():
+            return super().dispatch(request, *args, **kwargs)
+        action = getattr(self, 'action_map', {}).get(request.method.lower(), request.method.lower())
+        with Operation(f'{type(self).__name__}.{action}'):
+            response = super().dispatch(request, *args, **kwargs)
+            # Render here so JSON encoding counts towards the request
+            if hasattr(response, 'render'):
+                response.render()
+            return response
@@ -0,0 +1,135 @@
+import logging
+import random
+from contextlib import contextmanager
+from contextvars import ContextVar
+from urllib.parse import parse_qs
+
+from django.conf import settings
+from django.core.cache import caches
+
+logger = logging.getLogger(__name__)
+
+# True while a read-only code path runs; reads outside one stay on the primary
+_replica_reads = ContextVar('replica_reads', default=False)
+
+
+def replicas_enabled():
+    return bool(settings.DATABASE_REPLICAS)
+
+
+def pick_replica():
+    return random.choice(settings.DATABASE_REPLICAS)
+
+
+def request_clients(request, *usernames):
+    """
+    Identities whose recent writes a REST request should see: the given
+    usernames, the logged-in user and the client address (set by nginx).
+    """
+    clients = [f'user:{name}' for name in usernames if name]
+    user = getattr(request, 'user', None)
+    if user is not None and user.is_authenticated:
+        clients.append(f'user:{user.username}')
+    address = request.META.get('HTTP_X_REAL_IP') or request.META.get('REMOTE_ADDR')
+    if address:
+        clients.append(f'addr:{address}')
+    return clients
+
+
+def scope_clients(scope, *usernames):
+    """request_clients() for a WebSocket scope; `?user=` names the socket's user"""
+    query = parse_qs(scope.get('query_string', b'').decode())
+    clients = [f'user:{name}' for name in (*usernames, *query.get('user', [])) if name]
+    headers = dict(scope.get('headers', []))
+    address = headers.get(b'x-real-ip', b'').decode() or (scope.get('client') or [None])[0]
+    if address:
+        clients.append(f'addr:{address}')
+    return clients
+
+
+def pin_to_primary(*clients):
+    """
+    Send `clients`' reads to the primary for REPLICA_PIN_SECONDS after they
+    wrote, so they see their own writes despite replication lag.
+    The pins live in a cache shared by every server process.
+    """
+    if not replicas_enabled() or not clients:
+        return
+    try:
+        caches[settings.REPLICA_PIN_CACHE].set_many(
+            {f'replica-pin:{client}': 1 for client in clients},
+            settings.REPLICA_PIN_SECONDS
+        )
+    except Exception as e:
+        logger.warning("Could not pin %s to the primary: %r", clients, e)
+
+
+def is_pinned(*clients):
+    if not clients:
+        return False
+    try:
+        return bool(caches[settings.REPLICA_PIN_CACHE].get_many([f'replica-pin:{c}' for c in clients]))
+    except Exception as e:
+        # Without the pins we can't tell, so read from the primary
+        logger.warning("Could not check replica pins: %r", e)
+        return True
+
+
+@contextmanager
+def replica_reads(*clients):
+    """
+    Route the block's reads to a replica, unless one of `clients` wrote
+    within the pin window. Writes inside the block still go to the primary.
+    """
+    if not replicas_enabled() or is_pinned(*clients):
+        yield False
+        return
+    token = _replica_reads.set(True)
+    try:
+        yield True
+    finally:
+        _replica_reads.reset(token)
+
+
+class ReplicaRouter:
+    """
+    Database router for a primary with read replicas (DATABASE_REPLICA_URLS).
+    Only reads made inside replica_reads() go to a replica; everything else,
+    including every write, uses 'default'.
+    """
+
+    def db_for_read(self, model, **hints):
+        if _replica_reads.get() and settings.DATABASE_REPLICAS:
+            return pick_replica()
+        return None
+
+    def db_for_write(self, model, **hints):
+        return 'default'
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # Replicas hold the same data, so objects from any of them may relate
+        return True
+
+
+class ReplicaReadMixin:
+    """
+    Serves `replica_actions` from a read replica and pins the client to the
+    primary after any successful write request.
+    """
+    replica_actions = ('list', 'retrieve')
+
+    def replica_clients(self, request):
+        return request_clients(request, request.GET.get('user'))
+
+    def dispatch(self, request, *args, **kwargs):
+        if not replicas_enabled():
+            return super().dispatch(request, *args, **kwargs)
+        action = getattr(self, 'action_map', {}).get(request.method.lower())
+        clients = self.replica_clients(request)
+        if action in self.replica_actions:
+            with replica_reads(*clients):
+                return super().dispatch(request, *args, **kwargs)
+        response = super().dispatch(request, *args, **kwargs)
+        if request.method not in ('GET', 'HEAD', 'OPTIONS') and response.status_code < 400:
+            pin_to_primary(*clients)
+        return response
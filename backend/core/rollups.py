@@ -0,0 +1,160 @@
+"""
+Hourly activity rollups for rooms.
+
+Messages are folded into RoomActivity (messages and distinct senders per
+room per hour) and RoomActivitySender (messages per user per room per hour)
+in id order, starting after the `messages` watermark. Bulk inserts, COPY
+and the seed command bypass save() and signals, so the rollups catch up
+from the table instead of being updated per message. Counts are of
+messages posted; deleting a message later doesn't decrement them.
+"""
+import logging
+from datetime import timedelta, timezone
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Count, Sum
+from django.db.models.functions import Trunc
+from django.utils import timezone as django_timezone
+from .models import Message, RoomActivity, RoomActivitySender, RollupWatermark
+
+logger = logging.getLogger(__name__)
+
+MESSAGES = 'messages'
+INTERVALS = ('hour', 'day')
+
+
+def roll_up_messages(batch_size=10000):
+    """
+    Fold up to batch_size messages past the watermark into the rollups and
+    advance it, all in one transaction. Returns how many were folded in.
+
+    Only messages older than ACTIVITY_ROLLUP_LAG_SECONDS are picked up, so a
+    slower transaction that took a lower id has time to commit first.
+    """
+    cutoff = django_timezone.now() - timedelta(seconds=settings.ACTIVITY_ROLLUP_LAG_SECONDS)
+    with transaction.atomic():
+        watermark, _ = RollupWatermark.objects.select_for_update().get_or_create(name=MESSAGES)
+        pending = list(
+            Message.objects.filter(id__gt=watermark.last_id, timestamp__lte=cutoff)
+            .order_by('id').values_list('id', 'timestamp')[:batch_size]
+        )
+        if not pending:
+            return 0
+        upper, upper_timestamp = pending[-1]
+
+        counts = (
+            Message.objects.filter(id__gt=watermark.last_id, id__lte=upper)
+            .annotate(bucket=Trunc('timestamp', 'hour', tzinfo=timezone.utc))
+            .values_list('room_id', 'bucket', 'user_id')
+            .annotate(count=Count('id'))
+            .order_by()
+        )
+        folded = merge_counts({(room, bucket, user): count for room, bucket, user, count in counts})
+
+        watermark.last_id = upper
+        watermark.last_timestamp = upper_timestamp
+        watermark.save()
+    logger.info(
+        "Rolled up %d messages", folded,
+        extra={'event': 'rollup', 'rows': folded, 'last_id': upper}
+    )
+    return folded
+
+
+def merge_counts(counts):
+    """Add {(room_id, bucket, user_id): messages} to the rollup rows; returns the total added"""
+    rooms = {room for room, _, _ in counts}
+    buckets = {bucket for _, bucket, _ in counts}
+    # Superset of the affected rows (rooms x buckets), narrowed down below
+    senders = {
+        (row.room_id, row.bucket, row.user_id): row
+        for row in RoomActivitySender.objects.filter(room_id__in=rooms, bucket__in=buckets)
+    }
+    activity = {
+        (row.room_id, row.bucket): row
+        for row in RoomActivity.objects.filter(room_id__in=rooms, bucket__in=buckets)
+    }
+
+    new_senders, changed_senders = [], []
+    new_activity = {}
+    for (room, bucket, user), count in counts.items():
+        sender = senders.get((room, bucket, user))
+        if sender is None:
+            new_senders.append(RoomActivitySender(room_id=room, bucket=bucket, user_id=user, message_count=count))
+        else:
+            sender.message_count += count
+            changed_senders.append(sender)
+
+        row = activity.get((room, bucket))
+        if row is None:
+            row = activity[room, bucket] = new_activity[room, bucket] = RoomActivity(room_id=room, bucket=bucket)
+        row.message_count += count
+        if sender is None:
+            row.sender_count += 1
+
+    changed_activity = [row for key, row in activity.items() if key not in new_activity]
+    RoomActivitySender.objects.bulk_create(new_senders, batch_size=1000)
+    RoomActivitySender.objects.bulk_update(changed_senders, ['message_count'], batch_size=1000)
+    RoomActivity.objects.bulk_create(new_activity.values(), batch_size=1000)
+    RoomActivity.objects.bulk_update(changed_activity, ['message_count', 'sender_count'], batch_size=1000)
+    return sum(counts.values())
+
+
+def rebuild():
+    """Drop every rollup row and the watermark; the next run starts from the first message"""
+    with transaction.atomic():
+        RoomActivitySender.objects.all().delete()
+        RoomActivity.objects.all().delete()
+        RollupWatermark.objects.filter(name=MESSAGES).delete()
+
+
+def room_stats(room, since, until, interval='hour', top=10):
+    """
+    Activity of one room in [since, until), answered from the rollups alone:
+    per-bucket message and distinct sender counts, totals and top posters.
+    """
+    activity = RoomActivity.objects.filter(room=room, bucket__gte=since, bucket__lt=until)
+    senders = RoomActivitySender.objects.filter(room=room, bucket__gte=since, bucket__lt=until)
+
+    if interval == 'hour':
+        buckets = [
+            {'start': start, 'messages': messages, 'senders': distinct}
+            for start, messages, distinct in
+            activity.order_by('bucket').values_list('bucket', 'message_count', 'sender_count')
+        ]
+    else:
+        # Distinct senders don't add up across hours; count them again per bucket
+        start = Trunc('bucket', interval, tzinfo=timezone.utc)
+        messages = dict(
+            activity.annotate(start=start).values('start')
+            .annotate(total=Sum('message_count')).order_by().values_list('start', 'total')
+        )
+        distinct = dict(
+            senders.annotate(start=start).values('start')
+            .annotate(total=Count('user', distinct=True)).order_by().values_list('start', 'total')
+        )
+        buckets = [
+            {'start': start, 'messages': messages[start], 'senders': distinct.get(start, 0)}
+            for start in sorted(messages)
+        ]
+
+    top_posters = (
+        senders.values('user__username')
+        .annotate(messages=Sum('message_count'))
+        .order_by('-messages', 'user__username')[:top]
+    )
+    watermark = RollupWatermark.objects.filter(name=MESSAGES).values_list('last_timestamp', flat=True).first()
+    return {
+        'room': room.id,
+        'since': since,
+        'until': until,
+        'interval': interval,
+        'rolled_up_through': watermark,
+        'messages': sum(bucket['messages'] for bucket in buckets),
+        'active_users': senders.aggregate(total=Count('user', distinct=True))['total'],
+        'buckets': buckets,
+        'top_posters': [
+            {'username': poster['user__username'], 'messages': poster['messages']} for poster in top_posters
+        ],
+    }
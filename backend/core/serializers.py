@@ -1,6 +1,8 @@
 from rest_framework import serializers
+from django.conf import settings
 from django.contrib.auth.models import User
-from .models import Room, Message, DirectMessage
+from .attachments import attachment_metadata
+from .models import Room, Message, DirectMessage, Attachment
 
 
 class UserSerializer(serializers.ModelSerializer):
@@ -10,13 +12,27 @@ class UserSerializer(serializers.ModelSerializer):
         fields = ['id', 'username', 'email', 'first_name', 'last_name']
 
 
+class AttachmentSerializer(serializers.ModelSerializer):
+    """Serializer for Attachment metadata (the file itself is served by the download action)"""
+    url = serializers.SerializerMethodField()
+    
+    class Meta:
+        model = Attachment
+        fields = ['id', 'filename', 'content_type', 'size', 'sha256', 'url', 'created_at']
+        read_only_fields = fields
+    
+    def get_url(self, obj):
+        return attachment_metadata(obj)['url']
+
+
 class MessageSerializer(serializers.ModelSerializer):
     """Serializer for Message model"""
     username = serializers.CharField(source='user.username', read_only=True)
+    attachments = AttachmentSerializer(many=True, read_only=True)
     
     class Meta:
         model = Message
-        fields = ['id', 'username', 'content', 'timestamp']
+        fields = ['id', 'username', 'content', 'timestamp', 'attachments']
         read_only_fields = ['timestamp']
 
 
@@ -24,10 +40,11 @@ class DirectMessageSerializer(serializers.ModelSerializer):
     """Serializer for DirectMessage model"""
     sender_username = serializers.CharField(source='sender.username', read_only=True)
     recipient_username = serializers.CharField(source='recipient.username', read_only=True)
+    attachments = AttachmentSerializer(many=True, read_only=True)
     
     class Meta:
         model = DirectMessage
-        fields = ['id', 'sender_username', 'recipient_username', 'content', 'timestamp', 'is_read']
+        fields = ['id', 'sender_username', 'recipient_username', 'content', 'timestamp', 'is_read', 'attachments']
         read_only_fields = ['timestamp']
 
 
@@ -42,14 +59,29 @@ class RoomSerializer(serializers.ModelSerializer):
         fields = ['id', 'name', 'description', 'created_at', 'message_count', 'member_count', 'last_message']
         read_only_fields = ['created_at']
     
+    # The *_total and last_message_* attributes come from Room.objects.with_stats();
+    # rooms loaded without it fall back to per-room queries.
+    
     def get_message_count(self, obj):
+        if hasattr(obj, 'message_total'):
+            return obj.message_total
         return obj.messages.count()
     
     def get_member_count(self, obj):
+        if hasattr(obj, 'member_total'):
+            return obj.member_total
         return obj.members.count()
     
     def get_last_message(self, obj):
-        last_msg = obj.messages.last()
+        if hasattr(obj, 'last_message_timestamp'):
+            if obj.last_message_timestamp is None:
+                return None
+            return {
+                'username': obj.last_message_username,
+                'content': obj.last_message_content,
+                'timestamp': obj.last_message_timestamp
+            }
+        last_msg = obj.messages.select_related('user').last()
         if last_msg:
             return {
                 'username': last_msg.user.username,
@@ -57,3 +89,22 @@ class RoomSerializer(serializers.ModelSerializer):
                 'timestamp': last_msg.timestamp
             }
         return None
+
+
+class BulkMessageSerializer(serializers.Serializer):
+    """One message of a bulk post; `username` defaults to the authenticated user"""
+    message = serializers.CharField()
+    username = serializers.CharField(max_length=150, required=False)
+
+
+class BulkDirectMessageSerializer(BulkMessageSerializer):
+    recipient = serializers.CharField(max_length=150)
+
+
+class BulkMessagesSerializer(serializers.Serializer):
+    """Request body of the bulk endpoints: {"messages": [...]}, validated in one pass"""
+    messages = BulkMessageSerializer(many=True, allow_empty=False, max_length=settings.BULK_MESSAGES_MAX)
+
+
+class BulkDirectMessagesSerializer(serializers.Serializer):
+    messages = BulkDirectMessageSerializer(many=True, allow_empty=False, max_length=settings.BULK_MESSAGES_MAX)
@@ -0,0 +1,1117 @@
+import asyncio
+import hashlib
+import io
+import json
+import logging
+import threading
+import time
+import shutil
+import socket
+import tempfile
+from datetime import datetime, timedelta, timezone
+from pathlib import Path
+from unittest import mock, skipUnless
+from channels.db import database_sync_to_async
+from channels.generic.websocket import AsyncWebsocketConsumer
+from channels.layers import InMemoryChannelLayer
+from channels.testing import WebsocketCommunicator
+from django.conf import settings
+from django.contrib.auth.models import Permission, User
+from django.core.cache import caches
+from django.core.management import CommandError, call_command
+from django.db import connections
+from django.db.models import Count, QuerySet
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.test import SimpleTestCase, TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from ..attachments import link_attachments, parse_range
+from ..connections import HeartbeatMixin, connection_reaper
+from ..fanout import LocalFanout
+from ..logs import BackgroundHandler, JSONFormatter, SamplingFilter
+from ..management.commands.serve import bind_socket
+from ..middleware import ConnectionLimitMiddleware
+from ..models import Room, Message, DirectMessage, Attachment, IdempotencyKey, RoomActivity, RoomActivitySender
+from ..pagination import EstimatedCountPaginator
+from ..profiling import profiled
+from ..replicas import ReplicaRouter, is_pinned, pin_to_primary, replica_reads, scope_clients
+from ..rollups import roll_up_messages
+
+
+class AdminChangelistQueryTests(TestCase):
+    """Changelist query counts must not grow with the number of rows shown"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.admin_user = User.objects.create_superuser('admin', 'admin@example.com', 'password')
+        users = [User.objects.create(username=f'user{i}') for i in range(5)]
+        rooms = [Room.objects.create(name=f'room{i}') for i in range(5)]
+        Message.objects.bulk_create(
+            Message(room=rooms[i % 5], user=users[i % 3], content=f'message {i}')
+            for i in range(30)
+        )
+        DirectMessage.objects.bulk_create(
+            DirectMessage(sender=users[i % 5], recipient=users[(i + 1) % 5], content=f'dm {i}')
+            for i in range(30)
+        )
+
+    def setUp(self):
+        self.client.force_login(self.admin_user)
+
+    def assertChangelistQueries(self, url, num):
+        # Warm the session/content-type caches so only the changelist is measured
+        self.client.get(url)
+        with self.assertNumQueries(num):
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+
+    def test_room_changelist(self):
+        # session, user, result + full count, page (message counts come from a subquery)
+        self.assertChangelistQueries(reverse('admin:core_room_changelist'), 5)
+
+    def test_message_changelist(self):
+        # session, user, count, page with users/rooms joined; no room list for the filter
+        self.assertChangelistQueries(reverse('admin:core_message_changelist'), 4)
+
+    def test_message_room_filter(self):
+        url = reverse('admin:core_message_changelist')
+        response = self.client.get(url, {'room': 'room1', 'q': 'message'})
+        self.assertEqual({m.room.name for m in response.context['cl'].result_list}, {'room1'})
+        self.assertContains(response, 'name="room" value="room1"')
+        self.assertContains(response, '<input type="hidden" name="q" value="message">', html=True)
+        # No link per room
+        self.assertNotContains(self.client.get(url), 'room__id__exact')
+
+    def test_directmessage_changelist(self):
+        # session, user, count, page with senders/recipients joined
+        self.assertChangelistQueries(reverse('admin:core_directmessage_changelist'), 4)
+
+    def test_room_message_count(self):
+        response = self.client.get(reverse('admin:core_room_changelist'))
+        counts = {room.name: room._message_count for room in response.context['cl'].result_list}
+        self.assertEqual(counts, {f'room{i}': 6 for i in range(5)})
+
+
+class EstimatedCountPaginatorTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        user = User.objects.create(username='alice')
+        room = Room.objects.create(name='general')
+        Message.objects.bulk_create(
+            Message(room=room, user=user, content=str(i)) for i in range(3)
+        )
+
+    def test_falls_back_to_exact_count(self):
+        paginator = EstimatedCountPaginator(Message.objects.all(), 2)
+        self.assertIsNone(paginator.estimated_count())
+        self.assertEqual(paginator.count, 3)
+        self.assertEqual(paginator.num_pages, 2)
+
+    def test_filtered_queryset_is_not_estimated(self):
+        queryset = Message.objects.filter(content='1')
+        self.assertIsInstance(queryset, QuerySet)
+        self.assertIsNone(EstimatedCountPaginator(queryset, 2).estimated_count())
+        self.assertEqual(EstimatedCountPaginator(queryset, 2).count, 1)
+
+
+class AcceptConsumer(AsyncWebsocketConsumer):
+
+    async def connect(self):
+        await self.accept()
+
+
+class ConnectionLimitMiddlewareTests(SimpleTestCase):
+
+    async def test_rejects_connections_over_budget(self):
+        application = ConnectionLimitMiddleware(AcceptConsumer.as_asgi(), max_connections=1)
+
+        first = WebsocketCommunicator(application, '/ws/group/test/')
+        connected, _ = await first.connect()
+        self.assertTrue(connected)
+
+        second = WebsocketCommunicator(application, '/ws/group/test/')
+        await second.connect()
+        hint = await second.receive_json_from()
+        self.assertEqual(hint['type'], 'retry')
+        self.assertGreaterEqual(hint['retry_after'], settings.WEBSOCKET_RETRY_AFTER)
+        self.assertEqual((await second.receive_output())['code'], 1013)
+        self.assertEqual(application.rejected, 1)
+
+        # The slot is released once the first socket goes away
+        await first.disconnect()
+        third = WebsocketCommunicator(application, '/ws/group/test/')
+        connected, _ = await third.connect()
+        self.assertTrue(connected)
+        await third.disconnect()
+
+
+class HeartbeatConsumer(HeartbeatMixin, AsyncWebsocketConsumer):
+
+    async def connect(self):
+        await self.accept()
+
+    async def receive(self, text_data=None, bytes_data=None):
+        await self.send(text_data=text_data)
+
+
+@override_settings(
+    CHANNEL_LAYERS={'default': {'BACKEND': 'channels.layers.InMemoryChannelLayer'}},
+    WEBSOCKET_HEARTBEAT_INTERVAL=25, WEBSOCKET_HEARTBEAT_TIMEOUT=60,
+    WEBSOCKET_IDLE_TIMEOUT=0, WEBSOCKET_MAX_LIFETIME=0,
+)
+class ConnectionReaperTests(SimpleTestCase):
+
+    def setUp(self):
+        self.reaped = connection_reaper.reaped.copy()
+
+    async def connect(self):
+        communicator = WebsocketCommunicator(HeartbeatConsumer.as_asgi(), '/ws/group/test/')
+        await communicator.connect()
+        consumer = max(connection_reaper.consumers, key=lambda c: c.connected_at)
+        return communicator, consumer
+
+    async def sweep_after(self, communicator, consumer, seconds):
+        await connection_reaper.sweep(now=consumer.connected_at + seconds)
+        return await communicator.receive_output()
+
+    def reaped_since_setup(self, reason):
+        return connection_reaper.reaped[reason] - self.reaped[reason]
+
+    async def test_pings_and_pongs_keep_the_socket(self):
+        communicator, consumer = await self.connect()
+        output = await self.sweep_after(communicator, consumer, 25)
+        self.assertEqual(json.loads(output['text']), {'type': 'ping'})
+        await communicator.send_json_to({'type': 'pong'})
+        # Pongs are not passed on to receive()
+        self.assertTrue(await communicator.receive_nothing())
+        self.assertGreater(consumer.last_seen, consumer.connected_at)
+
+        consumer.last_seen = consumer.connected_at + 50
+        output = await self.sweep_after(communicator, consumer, 100)
+        self.assertEqual(output['type'], 'websocket.send')
+        await communicator.disconnect()
+        self.assertNotIn(consumer, connection_reaper.consumers)
+
+    async def test_silent_socket_is_reaped(self):
+        communicator, consumer = await self.connect()
+        output = await self.sweep_after(communicator, consumer, 61)
+        self.assertEqual((output['type'], output['code']), ('websocket.close', 4000))
+        self.assertNotIn(consumer, connection_reaper.consumers)
+        self.assertEqual(self.reaped_since_setup('heartbeat'), 1)
+        await communicator.disconnect()
+
+    async def test_idle_and_lifetime_timeouts(self):
+        with override_settings(WEBSOCKET_IDLE_TIMEOUT=30):
+            communicator, consumer = await self.connect()
+            consumer.last_seen = consumer.connected_at + 40
+            output = await self.sweep_after(communicator, consumer, 45)
+        self.assertEqual(output['code'], 4001)
+        self.assertEqual(self.reaped_since_setup('idle'), 1)
+        await communicator.disconnect()
+
+        with override_settings(WEBSOCKET_MAX_LIFETIME=3600):
+            communicator, consumer = await self.connect()
+            consumer.last_seen = consumer.connected_at + 3600
+            output = await self.sweep_after(communicator, consumer, 3601)
+        self.assertEqual(output['code'], 4002)
+        self.assertEqual(self.reaped_since_setup('lifetime'), 1)
+        await communicator.disconnect()
+
+
+class ServeCommandTests(SimpleTestCase):
+
+    def test_workers_can_share_a_port(self):
+        if not hasattr(socket, 'SO_REUSEPORT'):
+            self.skipTest('SO_REUSEPORT is not available')
+        first = bind_socket('127.0.0.1', 0, reuse_port=True)
+        port = first.getsockname()[1]
+        second = bind_socket('127.0.0.1', port, reuse_port=True)
+        self.assertEqual(second.getsockname()[1], port)
+        first.close()
+        second.close()
+
+
+class SeedChatCommandTests(TestCase):
+
+    def seed(self, *args):
+        call_command(
+            'seed_chat', '--users=30', '--rooms=10', '--messages=500', '--dm-threads=4',
+            '--dm-messages=200', '--chunk-size=64', *args, stdout=io.StringIO()
+        )
+        return list(Message.objects.order_by('id').values_list('room__name', 'user__username', 'content', 'timestamp'))
+
+    def test_deterministic_and_skewed(self):
+        first = self.seed('--seed=7')
+        self.assertEqual(len(first), 500)
+        self.assertEqual(DirectMessage.objects.count(), 200)
+        # Timestamps are generated, not the insert time
+        self.assertLess(first[-1][3].year, 2025)
+
+        self.assertEqual(self.seed('--seed=7', '--reset'), first)
+        self.assertNotEqual(self.seed('--seed=8', '--reset'), first)
+
+        busiest = Message.objects.values('room').annotate(n=Count('id')).order_by('-n')[0]['n']
+        self.assertGreater(busiest, 500 / 10 * 2)
+
+    def test_refuses_to_seed_twice(self):
+        self.seed()
+        with self.assertRaises(CommandError):
+            self.seed()
+
+
+class FakeConsumer:
+
+    def __init__(self, channel_layer):
+        self.channel_layer = channel_layer
+        self.events = []
+
+    async def dispatch(self, event):
+        self.events.append(event)
+
+
+class LocalFanoutTests(SimpleTestCase):
+
+    async def test_one_subscription_per_group(self):
+        layer = InMemoryChannelLayer()
+        fanout = LocalFanout()
+        consumers = [FakeConsumer(layer) for _ in range(3)]
+        for consumer in consumers:
+            await fanout.join('chat_lobby', consumer)
+
+        self.assertEqual(len(layer.groups['chat_lobby']), 1)
+        self.assertEqual(fanout.local_count('chat_lobby'), 3)
+
+        await layer.group_send('chat_lobby', {'type': 'chat_message', 'message': 'hi'})
+        for _ in range(10):
+            await asyncio.sleep(0)
+        for consumer in consumers:
+            self.assertEqual(consumer.events, [{'type': 'chat_message', 'message': 'hi'}])
+
+        for consumer in consumers:
+            await fanout.leave('chat_lobby', consumer)
+        self.assertFalse(layer.groups.get('chat_lobby'))
+        self.assertEqual(fanout.local_count('chat_lobby'), 0)
+
+    async def test_listener_survives_receive_errors(self):
+        layer = FlakyChannelLayer(failures=1)
+        fanout = LocalFanout()
+        fanout.retry_delay = 0
+        first = FakeConsumer(layer)
+        await fanout.join('chat_lobby', first)
+        subscription = fanout.subscriptions['chat_lobby']
+        # The membership is lost along with the connection
+        layer.groups.clear()
+        with self.assertLogs('core.fanout', 'WARNING'):
+            for _ in range(10):
+                await asyncio.sleep(0)
+        self.assertFalse(subscription.task.done())
+
+        second = FakeConsumer(layer)
+        await fanout.join('chat_lobby', second)
+        await layer.group_send('chat_lobby', {'type': 'chat_message', 'message': 'hi'})
+        for _ in range(10):
+            await asyncio.sleep(0)
+        self.assertEqual(len(first.events), 1)
+        self.assertEqual(len(second.events), 1)
+        for consumer in (first, second):
+            await fanout.leave('chat_lobby', consumer)
+
+    async def test_membership_refreshed_while_idle(self):
+        layer = InMemoryChannelLayer()
+        fanout = LocalFanout()
+        fanout.refresh_interval = 0.01
+        consumer = FakeConsumer(layer)
+        await fanout.join('chat_lobby', consumer)
+        # channels_redis would expire it after group_expiry
+        layer.groups.clear()
+        await asyncio.sleep(0.05)
+        self.assertEqual(len(layer.groups['chat_lobby']), 1)
+
+        await layer.group_send('chat_lobby', {'type': 'chat_message', 'message': 'hi'})
+        for _ in range(10):
+            await asyncio.sleep(0)
+        self.assertEqual(len(consumer.events), 1)
+        await fanout.leave('chat_lobby', consumer)
+
+    async def test_failed_setup_fails_every_waiting_joiner(self):
+        layer = FailingGroupAddLayer(failures=1)
+        fanout = LocalFanout()
+        first, second = FakeConsumer(layer), FakeConsumer(layer)
+        results = await asyncio.gather(
+            fanout.join('chat_lobby', first), fanout.join('chat_lobby', second),
+            return_exceptions=True
+        )
+        self.assertIsInstance(results[0], ConnectionError)
+        self.assertIs(results[1], results[0])
+        self.assertNotIn('chat_lobby', fanout.subscriptions)
+
+        # The next socket sets the subscription up from scratch
+        third = FakeConsumer(layer)
+        await fanout.join('chat_lobby', third)
+        self.assertEqual(fanout.subscriptions['chat_lobby'].consumers, {third})
+        await layer.group_send('chat_lobby', {'type': 'chat_message', 'message': 'hi'})
+        for _ in range(10):
+            await asyncio.sleep(0)
+        self.assertEqual(len(third.events), 1)
+        await fanout.leave('chat_lobby', third)
+
+    async def test_slow_socket_does_not_hold_up_the_room(self):
+        layer = InMemoryChannelLayer()
+        fanout = LocalFanout()
+        fanout.delivery_timeout = 0.05
+        fast, slow = FakeConsumer(layer), StuckConsumer(layer)
+        for consumer in (fast, slow):
+            await fanout.join('chat_lobby', consumer)
+
+        with self.assertLogs('core.fanout', 'WARNING') as logs:
+            for i in range(3):
+                await layer.group_send('chat_lobby', {'type': 'chat_message', 'message': f'm{i}'})
+            await asyncio.sleep(0.3)
+        self.assertEqual([event['message'] for event in fast.events], ['m0', 'm1', 'm2'])
+        self.assertIn('slower than', logs.output[0])
+        for consumer in (fast, slow):
+            await fanout.leave('chat_lobby', consumer)
+
+
+class StuckConsumer(FakeConsumer):
+    """Consumer whose socket never drains"""
+
+    async def dispatch(self, event):
+        await asyncio.sleep(60)
+
+
+class FailingGroupAddLayer(InMemoryChannelLayer):
+    """In-memory layer whose first `failures` group_adds fail"""
+
+    def __init__(self, failures):
+        super().__init__()
+        self.failures = failures
+
+    async def group_add(self, group, channel):
+        if self.failures:
+            self.failures -= 1
+            # Let other joiners start waiting before this one fails
+            await asyncio.sleep(0)
+            raise ConnectionError('connection lost')
+        return await super().group_add(group, channel)
+
+
+class FlakyChannelLayer(InMemoryChannelLayer):
+    """In-memory layer whose first `failures` receives fail, like a dropped Redis connection"""
+
+    def __init__(self, failures):
+        super().__init__()
+        self.failures = failures
+
+    async def receive(self, channel):
+        if self.failures:
+            self.failures -= 1
+            await asyncio.sleep(0)
+            raise ConnectionError('connection lost')
+        return await super().receive(channel)
+
+
+def chat_event(i):
+    return {'type': 'chat_message', 'message': f'm{i}', 'username': 'alice', 'timestamp': ''}
+
+
+@override_settings(CHAT_BATCH_FRAMES=True, CHAT_BATCH_MAX_DELAY_MS=20, CHAT_BATCH_MAX_SIZE=3)
+class FrameBatchingTests(SimpleTestCase):
+
+    def setUp(self):
+        from ..consumers import ChatConsumer
+        self.frames = []
+        self.consumer = ChatConsumer()
+
+        async def base_send(message):
+            self.frames.append(json.loads(message['text']))
+        self.consumer.base_send = base_send
+
+    async def test_burst_is_coalesced(self):
+        for i in range(2):
+            await self.consumer.chat_message(chat_event(i))
+        self.assertEqual(self.frames, [])
+        await asyncio.sleep(0.05)
+        self.assertEqual(len(self.frames), 1)
+        self.assertEqual(self.frames[0]['type'], 'chat_batch')
+        self.assertEqual([m['message'] for m in self.frames[0]['messages']], ['m0', 'm1'])
+
+    async def test_single_frame_is_sent_unchanged(self):
+        await self.consumer.chat_message(chat_event(0))
+        await asyncio.sleep(0.05)
+        self.assertEqual([f['type'] for f in self.frames], ['chat_message'])
+
+    async def test_max_size_flushes_without_waiting(self):
+        for i in range(4):
+            await self.consumer.chat_message(chat_event(i))
+        self.assertEqual(len(self.frames), 1)
+        self.assertEqual(len(self.frames[0]['messages']), 3)
+        await asyncio.sleep(0.05)
+        self.assertEqual(self.frames[1]['message'], 'm3')
+
+    async def test_overdue_frames_flush_when_the_next_one_arrives(self):
+        await self.consumer.chat_message(chat_event(0))
+        # A busy event loop: the flush timer gets no chance to run
+        time.sleep(0.03)
+        await self.consumer.chat_message(chat_event(1))
+        self.assertEqual(len(self.frames), 1)
+        self.assertEqual([m['message'] for m in self.frames[0]['messages']], ['m0', 'm1'])
+
+    async def test_disabled(self):
+        with override_settings(CHAT_BATCH_FRAMES=False):
+            await self.consumer.chat_message(chat_event(0))
+        self.assertEqual(self.frames[0]['message'], 'm0')
+
+    async def test_bulk_batch_follows_queued_frames(self):
+        await self.consumer.chat_message(chat_event(0))
+        await self.consumer.chat_batch({'type': 'chat_batch', 'messages': [chat_event(1), chat_event(2)]})
+        self.assertEqual([f['type'] for f in self.frames], ['chat_message', 'chat_batch'])
+        self.assertEqual(len(self.frames[1]['messages']), 2)
+
+
+class AttachmentTests(TestCase):
+
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.root)
+        settings_override = override_settings(ATTACHMENT_ROOT=Path(self.root), ATTACHMENT_ACCEL_REDIRECT='')
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+        self.alice = User.objects.create(username='alice')
+
+    def upload(self, content, name='notes.txt', content_type='text/plain', username='alice', **data):
+        return self.client.post('/api/attachments/', {
+            'file': SimpleUploadedFile(name, content, content_type=content_type), 'username': username, **data
+        })
+
+    def test_upload_is_stored_by_content_hash(self):
+        content = b'hello attachment'
+        response = self.upload(content, username='alice')
+        self.assertEqual(response.status_code, 201)
+        sha256 = hashlib.sha256(content).hexdigest()
+        self.assertEqual(response.data['sha256'], sha256)
+        self.assertEqual(response.data['size'], len(content))
+
+        attachment = Attachment.objects.get(id=response.data['id'])
+        self.assertEqual(attachment.uploaded_by.username, 'alice')
+        self.assertEqual((Path(self.root) / attachment.storage_name).read_bytes(), content)
+        # Nothing left behind in the temp directory
+        self.assertEqual(list((Path(self.root) / 'tmp').iterdir()), [])
+
+    def test_upload_needs_an_existing_user(self):
+        tmp = Path(self.root) / 'tmp'
+        for username in ('', 'nobody'):
+            self.assertEqual(self.upload(b'x', username=username).status_code, 400)
+        self.assertFalse(User.objects.filter(username='nobody').exists())
+        self.assertEqual(list(tmp.iterdir()), [])
+
+        bob = User.objects.create(username='bob')
+        self.client.force_login(bob)
+        # The logged-in user wins over the form field
+        response = self.upload(b'x', username='alice')
+        self.assertEqual(Attachment.objects.get(id=response.data['id']).uploaded_by, bob)
+
+    def test_duplicate_content_is_written_once(self):
+        first = self.upload(b'same bytes', name='a.txt')
+        second = self.upload(b'same bytes', name='b.txt')
+        self.assertNotEqual(first.data['id'], second.data['id'])
+        self.assertEqual(first.data['sha256'], second.data['sha256'])
+        stored = [path for path in Path(self.root).rglob('*') if path.is_file()]
+        self.assertEqual(len(stored), 1)
+
+    def test_oversized_upload_is_rejected(self):
+        with override_settings(ATTACHMENT_MAX_SIZE=10):
+            response = self.upload(b'x' * 100000)
+        self.assertEqual(response.status_code, 400)
+        self.assertFalse(Attachment.objects.exists())
+
+    def test_download_and_range(self):
+        content = bytes(range(256)) * 4
+        attachment_id = self.upload(content, name='data.bin', content_type='application/octet-stream').data['id']
+        url = f'/api/attachments/{attachment_id}/download/'
+
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(b''.join(response.streaming_content), content)
+        self.assertEqual(response['Accept-Ranges'], 'bytes')
+        self.assertIn('attachment; filename="data.bin"', response['Content-Disposition'])
+
+        response = self.client.get(url, HTTP_RANGE='bytes=10-19')
+        self.assertEqual(response.status_code, 206)
+        self.assertEqual(response['Content-Range'], f'bytes 10-19/{len(content)}')
+        self.assertEqual(b''.join(response.streaming_content), content[10:20])
+
+        response = self.client.get(url, HTTP_RANGE=f'bytes={len(content)}-')
+        self.assertEqual(response.status_code, 416)
+
+    def test_missing_file_is_404(self):
+        attachment_id = self.upload(b'gone').data['id']
+        attachment = Attachment.objects.get(id=attachment_id)
+        (Path(self.root) / attachment.storage_name).unlink()
+        self.assertEqual(self.client.get(f'/api/attachments/{attachment_id}/download/').status_code, 404)
+
+    def test_download_through_nginx(self):
+        attachment_id = self.upload(b'img', name='shot.png', content_type='image/png').data['id']
+        attachment = Attachment.objects.get(id=attachment_id)
+        with override_settings(ATTACHMENT_ACCEL_REDIRECT='/protected-attachments/'):
+            response = self.client.get(f'/api/attachments/{attachment_id}/download/')
+        self.assertEqual(response['X-Accel-Redirect'], '/protected-attachments/' + attachment.storage_name)
+        self.assertEqual(response['Content-Type'], 'image/png')
+        self.assertEqual(response.content, b'')
+        self.assertIn('inline', response['Content-Disposition'])
+        self.assertEqual(response['Content-Security-Policy'], 'sandbox')
+
+    def test_only_raster_images_are_inline(self):
+        svg = b'<svg xmlns="http://www.w3.org/2000/svg"><script>alert(1)</script></svg>'
+        for content, name, content_type, disposition in (
+            (svg, 'x.svg', 'image/svg+xml', 'attachment'),
+            (b'<script>alert(1)</script>', 'x.html', 'text/html', 'attachment'),
+            (b'gif', 'x.gif', 'image/gif', 'inline'),
+        ):
+            attachment_id = self.upload(content, name=name, content_type=content_type).data['id']
+            response = self.client.get(f'/api/attachments/{attachment_id}/download/')
+            self.assertTrue(response['Content-Disposition'].startswith(disposition), content_type)
+            self.assertEqual(response['Content-Security-Policy'], 'sandbox')
+            self.assertEqual(response['X-Content-Type-Options'], 'nosniff')
+
+    def test_unstored_uploads_are_removed(self):
+        tmp = Path(self.root) / 'tmp'
+        response = self.client.post('/api/attachments/', {
+            'file': SimpleUploadedFile('a.txt', b'a'),
+            'other': SimpleUploadedFile('b.txt', b'b'),
+            'username': 'alice',
+        })
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(list(tmp.iterdir()), [])
+
+        response = self.client.post('/api/attachments/', {'other': SimpleUploadedFile('b.txt', b'b')})
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(list(tmp.iterdir()), [])
+
+    def test_link_attachments_only_once(self):
+        user = self.alice
+        room = Room.objects.create(name='general')
+        attachment_id = self.upload(b'doc').data['id']
+        message = Message.objects.create(room=room, user=user, content='')
+
+        linked = link_attachments([attachment_id], user, message=message)
+        self.assertEqual([a['id'] for a in linked], [attachment_id])
+        self.assertEqual(linked[0]['url'], f'/api/attachments/{attachment_id}/download/')
+        # Already used, and foreign uploads, are ignored
+        self.assertEqual(link_attachments([attachment_id], user, message=message), [])
+        other = User.objects.create(username='mallory')
+        self.assertEqual(link_attachments([attachment_id], other, message=message), [])
+        # Uploads without an owner can't be claimed by guessing their id
+        orphan = Attachment.objects.create(sha256='0' * 64, size=1, filename='x', content_type='text/plain')
+        self.assertEqual(link_attachments([orphan.id], user, message=message), [])
+
+        response = self.client.get(f'/api/rooms/{room.id}/messages/')
+        self.assertEqual(response.data[0]['attachments'][0]['id'], attachment_id)
+
+    def test_parse_range(self):
+        self.assertIsNone(parse_range(None, 100))
+        self.assertIsNone(parse_range('bytes=0-1,5-6', 100))
+        self.assertEqual(parse_range('bytes=0-', 100), (0, 99))
+        self.assertEqual(parse_range('bytes=-10', 100), (90, 99))
+        self.assertEqual(parse_range('bytes=90-200', 100), (90, 99))
+        with self.assertRaises(ValueError):
+            parse_range('bytes=100-', 100)
+
+
+class ProfilingTests(TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory)
+
+    def test_disabled_by_default(self):
+        with self.assertNoLogs('core.profiling'):
+            self.client.get('/api/rooms/')
+        self.assertEqual(list(Path(self.directory).iterdir()), [])
+
+    def test_sampled_request_writes_profile_and_logs_queries(self):
+        Room.objects.create(name='general')
+        with override_settings(PROFILING_SAMPLE_RATE=1.0, PROFILING_SLOW_MS=0.001, PROFILING_DIR=self.directory):
+            with self.assertLogs('core.profiling', 'WARNING') as logs:
+                self.client.get('/api/rooms/')
+
+        profiles = [path.name for path in Path(self.directory).iterdir()]
+        self.assertEqual(len(profiles), 1)
+        self.assertTrue(profiles[0].startswith('RoomViewSet.list-'))
+        record = logs.records[0]
+        self.assertEqual(record.operation, 'RoomViewSet.list')
+        self.assertGreater(record.queries, 0)
+
+    async def test_consumer_hook_counts_queries_in_threads(self):
+        @profiled('Test.receive')
+        async def receive():
+            from channels.db import database_sync_to_async
+            await database_sync_to_async(lambda: list(Room.objects.all()))()
+
+        with override_settings(PROFILING_SLOW_MS=0.001, PROFILING_DIR=self.directory):
+            with self.assertLogs('core.profiling', 'WARNING') as logs:
+                await receive()
+        self.assertEqual(logs.records[0].operation, 'Test.receive')
+        self.assertEqual(logs.records[0].queries, 1)
+        # Sampling is off, so nothing is written
+        self.assertEqual(list(Path(self.directory).iterdir()), [])
+
+
+PIN_CACHES = {
+    'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'},
+    'replica_pins': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache', 'LOCATION': 'pins'},
+}
+
+
+@override_settings(DATABASE_REPLICAS=['replica_0'], CACHES=PIN_CACHES)
+class ReplicaRouterTests(SimpleTestCase):
+
+    def setUp(self):
+        self.router = ReplicaRouter()
+        caches['replica_pins'].clear()
+
+    def test_reads_use_primary_outside_replica_blocks(self):
+        self.assertIsNone(self.router.db_for_read(Message))
+        with replica_reads('user:alice'):
+            self.assertEqual(self.router.db_for_read(Message), 'replica_0')
+            self.assertEqual(self.router.db_for_write(Message), 'default')
+        self.assertIsNone(self.router.db_for_read(Message))
+
+    def test_client_that_wrote_is_pinned_to_primary(self):
+        pin_to_primary('user:alice')
+        self.assertTrue(is_pinned('addr:10.0.0.1', 'user:alice'))
+        with replica_reads('addr:10.0.0.1', 'user:alice'):
+            self.assertIsNone(self.router.db_for_read(Message))
+        with replica_reads('user:bob'):
+            self.assertEqual(self.router.db_for_read(Message), 'replica_0')
+
+    def test_pins_expire(self):
+        with override_settings(REPLICA_PIN_SECONDS=0):
+            pin_to_primary('user:alice')
+        self.assertFalse(is_pinned('user:alice'))
+
+    @override_settings(DATABASE_REPLICAS=[])
+    def test_no_replicas_configured(self):
+        pin_to_primary('user:alice')
+        self.assertFalse(is_pinned('user:alice'))
+        with replica_reads():
+            self.assertIsNone(self.router.db_for_read(Message))
+
+    def test_scope_clients(self):
+        scope = {
+            'query_string': b'user=alice',
+            'headers': [(b'x-real-ip', b'10.0.0.1')],
+            'client': ['172.18.0.5', 50000],
+        }
+        self.assertEqual(scope_clients(scope, 'bob'), ['user:bob', 'user:alice', 'addr:10.0.0.1'])
+        self.assertEqual(scope_clients({'client': ['127.0.0.1', 1]}), ['addr:127.0.0.1'])
+
+
+@override_settings(DATABASE_REPLICAS=['default'], CACHES=PIN_CACHES)
+class ReplicaViewTests(TestCase):
+    """Which requests may read from a replica (the replica here is the primary itself)"""
+
+    def setUp(self):
+        caches['replica_pins'].clear()
+        self.room = Room.objects.create(name='general')
+        patcher = mock.patch('core.replicas.pick_replica', return_value='default')
+        self.choose_replica = patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_read_actions_use_replica(self):
+        self.client.get('/api/rooms/')
+        self.assertTrue(self.choose_replica.called)
+
+    def test_writes_and_attachments_use_primary(self):
+        self.client.post('/api/rooms/create_or_get/', {'name': 'new'}, REMOTE_ADDR='10.0.0.9')
+        self.client.get('/api/attachments/')
+        self.assertFalse(self.choose_replica.called)
+
+    def test_client_reads_primary_after_writing(self):
+        self.client.post('/api/rooms/create_or_get/', {'name': 'new'}, REMOTE_ADDR='10.0.0.9')
+        response = self.client.get('/api/rooms/', REMOTE_ADDR='10.0.0.9')
+        self.assertFalse(self.choose_replica.called)
+        self.assertIn('new', [room['name'] for room in response.json()])
+
+        self.client.get('/api/rooms/', REMOTE_ADDR='10.0.0.10')
+        self.assertTrue(self.choose_replica.called)
+
+    async def test_consumer_history_uses_replica_until_user_writes(self):
+        from ..consumers import ChatConsumer
+        application = ChatConsumer.as_asgi()
+        with override_settings(CHANNEL_LAYERS={'default': {'BACKEND': 'channels.layers.InMemoryChannelLayer'}}):
+            communicator = WebsocketCommunicator(application, '/ws/group/general/?user=alice')
+            communicator.scope['url_route'] = {'kwargs': {'room_name': 'general'}}
+            await communicator.connect()
+            await communicator.receive_json_from()
+            self.assertTrue(self.choose_replica.called)
+
+            self.choose_replica.reset_mock()
+            await communicator.send_json_to({'username': 'alice', 'message': 'hi'})
+            await communicator.receive_json_from()
+            await communicator.disconnect()
+
+            communicator = WebsocketCommunicator(application, '/ws/group/general/?user=alice')
+            communicator.scope['url_route'] = {'kwargs': {'room_name': 'general'}}
+            await communicator.connect()
+            history = await communicator.receive_json_from()
+            await communicator.disconnect()
+        self.assertFalse(self.choose_replica.called)
+        self.assertEqual([m['message'] for m in history['messages']], ['hi'])
+
+
+@skipUnless(settings.DATABASE_REPLICAS, 'set DATABASE_REPLICA_URLS, e.g. sqlite:///replica.sqlite3')
+@override_settings(CACHES=PIN_CACHES)
+class ReplicaDatabaseTests(TransactionTestCase):
+    """
+    Runs against real replica aliases, which mirror the test database.
+    The replica is a separate connection, so the data must be committed.
+    """
+    databases = '__all__'
+
+    def test_list_queries_replica(self):
+        Room.objects.create(name='general')
+        replica = connections[settings.DATABASE_REPLICAS[0]]
+        with CaptureQueriesContext(replica) as queries:
+            with mock.patch('core.replicas.pick_replica', return_value=replica.alias):
+                response = self.client.get('/api/rooms/')
+        self.assertEqual(response.status_code, 200)
+        self.assertGreater(len(queries), 0)
+
+
+class SlowStream:
+    """A log destination that takes `delay` seconds per write, like a stalled log driver"""
+
+    def __init__(self, delay=0.0, gate=None):
+        self.delay = delay
+        self.gate = gate
+        self.lines = []
+
+    def write(self, text):
+        if self.gate is not None:
+            self.gate.wait()
+        time.sleep(self.delay)
+        self.lines.extend(line for line in text.splitlines() if line)
+
+    def flush(self):
+        pass
+
+
+class BackgroundLoggingTests(SimpleTestCase):
+
+    def make_logger(self, handler):
+        handler.setFormatter(JSONFormatter())
+        logger = logging.getLogger(f'core.tests.{self._testMethodName}')
+        logger.addHandler(handler)
+        logger.setLevel(logging.INFO)
+        logger.propagate = False
+        self.addCleanup(logger.removeHandler, handler)
+        self.addCleanup(handler.close)
+        return logger
+
+    async def test_event_loop_is_not_blocked_by_log_io(self):
+        stream = SlowStream(delay=0.02)
+        handler = BackgroundHandler(stream=stream)
+        logger = self.make_logger(handler)
+        loop = asyncio.get_running_loop()
+
+        longest_call = 0.0
+        longest_gap = 0.0
+        previous = loop.time()
+        for i in range(20):
+            started = time.perf_counter()
+            logger.info("User connected to %s", 'lobby', extra={'event': 'connect', 'n': i})
+            longest_call = max(longest_call, time.perf_counter() - started)
+            await asyncio.sleep(0.001)
+            now = loop.time()
+            longest_gap = max(longest_gap, now - previous)
+            previous = now
+
+        # Writing took 20 x 20ms, none of which was spent on the loop
+        self.assertLess(longest_call, 0.01)
+        self.assertLess(longest_gap, 0.015)
+        handler.close()
+        self.assertEqual(len(stream.lines), 20)
+        entry = json.loads(stream.lines[0])
+        self.assertEqual(entry['message'], 'User connected to lobby')
+        self.assertEqual((entry['level'], entry['event'], entry['n']), ('INFO', 'connect', 0))
+
+    def test_full_queue_drops_instead_of_blocking(self):
+        gate = threading.Event()
+        stream = SlowStream(gate=gate)
+        handler = BackgroundHandler(stream=stream, queue_size=2)
+        logger = self.make_logger(handler)
+        started = time.perf_counter()
+        for i in range(10):
+            logger.warning("burst %d", i)
+        self.assertLess(time.perf_counter() - started, 0.1)
+        self.assertGreaterEqual(handler.dropped, 7)
+        gate.set()
+        handler.close()
+        # Kept records, then the report of the dropped ones on close
+        report = json.loads(stream.lines[-1])
+        self.assertEqual((report['level'], report['event'], report['dropped']), ('WARNING', 'logs_dropped', handler.dropped))
+        self.assertEqual(len(stream.lines) - 1 + handler.dropped, 10)
+
+    def test_drops_are_reported_periodically(self):
+        gate = threading.Event()
+        stream = SlowStream(gate=gate)
+        handler = BackgroundHandler(stream=stream, queue_size=2, report_interval=0)
+        logger = self.make_logger(handler)
+        for i in range(5):
+            logger.warning("burst %d", i)
+        dropped = handler.dropped
+        gate.set()
+        handler.flush()
+        logger.warning("after the burst")
+        handler.flush()
+        reports = [json.loads(line) for line in stream.lines if 'logs_dropped' in line]
+        self.assertTrue(reports)
+        self.assertEqual(sum(r['dropped'] for r in reports), dropped)
+        self.assertEqual(handler.reported, dropped)
+
+    def test_exceptions_are_formatted(self):
+        stream = SlowStream()
+        handler = BackgroundHandler(stream=stream)
+        logger = self.make_logger(handler)
+        try:
+            1 / 0
+        except ZeroDivisionError:
+            logger.exception("DB save error")
+        handler.close()
+        self.assertIn('ZeroDivisionError', json.loads(stream.lines[0])['exception'])
+
+    def test_sampling_keeps_warnings(self):
+        sampler = SamplingFilter(rate=0.25)
+        info = logging.makeLogRecord({'levelno': logging.INFO})
+        with mock.patch('core.logs.random.random', return_value=0.5):
+            self.assertFalse(sampler.filter(info))
+            self.assertTrue(sampler.filter(logging.makeLogRecord({'levelno': logging.WARNING})))
+        with mock.patch('core.logs.random.random', return_value=0.1):
+            self.assertTrue(sampler.filter(info))
+        self.assertEqual(info.sample_rate, 0.25)
+
+
+@override_settings(CHANNEL_LAYERS={'default': {'BACKEND': 'channels.layers.InMemoryChannelLayer'}})
+class ConsumerAttachmentValidationTests(TestCase):
+    """`attachments` must be a list of ids; anything else is refused before saving"""
+
+    def setUp(self):
+        self.alice = User.objects.create(username='alice')
+        self.attachments = [
+            Attachment.objects.create(sha256=str(i) * 64, size=1, filename=f'{i}.txt',
+                                      content_type='text/plain', uploaded_by=self.alice)
+            for i in (1, 2)
+        ]
+
+    async def assertRejected(self, attachments):
+        from channels.routing import URLRouter
+        from ..routing import websocket_urlpatterns
+        for path in ('/ws/group/general/?user=alice', '/ws/dm/bob/?user=alice'):
+            communicator = WebsocketCommunicator(URLRouter(websocket_urlpatterns), path)
+            connected, _ = await communicator.connect()
+            self.assertTrue(connected)
+            await communicator.receive_json_from()  # history
+            await communicator.send_json_to({'username': 'alice', 'message': 'hi', 'attachments': attachments})
+            frame = await communicator.receive_json_from()
+            await communicator.disconnect()
+            self.assertEqual(frame['type'], 'error', path)
+
+        # Nothing saved, nothing broadcast, nothing linked
+        counts = await database_sync_to_async(lambda: (
+            Message.objects.count(),
+            DirectMessage.objects.count(),
+            Attachment.objects.filter(message__isnull=False).count(),
+        ))()
+        self.assertEqual(counts, (0, 0, 0))
+
+    async def test_string_is_not_split_into_ids(self):
+        # "12" used to link attachments 1 and 2
+        await self.assertRejected('12')
+
+    async def test_int_is_rejected_before_saving(self):
+        # 5 used to fail in list() after the message row was written
+        await self.assertRejected(5)
+
+    async def test_other_shapes_are_rejected(self):
+        for attachments in ([1, '2'], [True], {'id': 1}, list(range(1, 20))):
+            await self.assertRejected(attachments)
+
+
+@override_settings(CHANNEL_LAYERS={'default': {'BACKEND': 'channels.layers.InMemoryChannelLayer'}})
+class BulkPostTests(TestCase):
+
+    def setUp(self):
+        self.bot = User.objects.create(username='bot')
+        self.room = Room.objects.create(name='general')
+        self.url = f'/api/rooms/{self.room.id}/bulk_messages/'
+        self.client.force_login(self.bot)
+
+    def post(self, url, messages, **headers):
+        return self.client.post(url, {'messages': messages}, content_type='application/json', headers=headers)
+
+    async def listen(self, group):
+        from channels.layers import get_channel_layer
+        layer = get_channel_layer()
+        channel = await layer.new_channel()
+        await layer.group_add(group, channel)
+        return layer, channel
+
+    def test_requires_authentication(self):
+        self.client.logout()
+        response = self.post(self.url, [{'message': 'hi'}])
+        self.assertIn(response.status_code, (401, 403))
+
+    def test_regular_user_cannot_set_another_author(self):
+        for url, item in ((self.url, {}), ('/api/direct-messages/bulk/', {'recipient': 'alice'})):
+            response = self.post(url, [{'message': 'mine', **item}, {'message': 'hi', 'username': 'admin', **item}])
+            self.assertEqual(response.status_code, 403)
+        self.assertFalse(User.objects.filter(username='admin').exists())
+        self.assertEqual(self.post(self.url, [{'message': 'mine', 'username': 'bot'}]).status_code, 201)
+
+    def test_bulk_insert_and_single_broadcast(self):
+        from asgiref.sync import async_to_sync
+        self.bot.user_permissions.add(Permission.objects.get(codename='post_as_other_users'))
+        layer, channel = async_to_sync(self.listen)('chat_general')
+        messages = [{'message': f'announcement {i}'} for i in range(300)] + [{'message': 'hi', 'username': 'replayed'}]
+        with self.captureOnCommitCallbacks(execute=True):
+            with CaptureQueriesContext(connections['default']) as queries:
+                response = self.post(self.url, messages)
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(response.json()['created'], 301)
+        self.assertEqual(self.room.messages.count(), 301)
+        self.assertEqual(self.room.messages.last().user.username, 'replayed')
+        inserts = [q for q in queries.captured_queries if q['sql'].startswith('INSERT INTO "core_message"')]
+        # One statement; SQLite splits it at its bound-parameter limit
+        self.assertLessEqual(len(inserts), 2)
+
+        event = async_to_sync(layer.receive)(channel)
+        self.assertEqual(event['type'], 'chat_batch')
+        self.assertEqual(len(event['messages']), 301)
+
+    def test_invalid_items_insert_nothing(self):
+        response = self.post(self.url, [{'message': 'ok'}, {'message': ''}, {}])
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(len(response.json()['messages']), 3)
+        self.assertEqual(self.room.messages.count(), 0)
+        self.assertEqual(self.post(self.url, []).status_code, 400)
+
+    def test_idempotency_key(self):
+        messages = [{'message': 'once'}, {'message': 'twice?'}]
+        first = self.post(self.url, messages, **{'Idempotency-Key': 'abc'})
+        retry = self.post(self.url, messages, **{'Idempotency-Key': 'abc'})
+        self.assertEqual(first.status_code, 201)
+        self.assertEqual(retry.status_code, 201)
+        self.assertEqual(retry.json(), first.json())
+        self.assertEqual(retry['Idempotent-Replayed'], 'true')
+        self.assertEqual(self.room.messages.count(), 2)
+        self.assertEqual(IdempotencyKey.objects.count(), 1)
+
+        conflict = self.post(self.url, [{'message': 'other'}], **{'Idempotency-Key': 'abc'})
+        self.assertEqual(conflict.status_code, 422)
+        # Keys are per endpoint
+        other_room = Room.objects.create(name='other')
+        response = self.post(f'/api/rooms/{other_room.id}/bulk_messages/', messages, **{'Idempotency-Key': 'abc'})
+        self.assertNotIn('Idempotent-Replayed', response)
+
+    def test_expired_idempotency_keys(self):
+        messages = [{'message': 'hi'}]
+        self.post(self.url, messages, **{'Idempotency-Key': 'old'})
+        self.post(self.url, messages, **{'Idempotency-Key': 'new'})
+        IdempotencyKey.objects.filter(key='old').update(created_at=datetime.now(timezone.utc) - timedelta(hours=25))
+
+        # Past the window a key starts over instead of replaying
+        response = self.post(self.url, [{'message': 'different'}], **{'Idempotency-Key': 'old'})
+        self.assertEqual(response.status_code, 201)
+        self.assertNotIn('Idempotent-Replayed', response)
+
+        IdempotencyKey.objects.filter(key='old').update(created_at=datetime.now(timezone.utc) - timedelta(hours=25))
+        out = io.StringIO()
+        call_command('purge_idempotency_keys', stdout=out)
+        self.assertIn('Purged 1 ', out.getvalue())
+        self.assertEqual(list(IdempotencyKey.objects.values_list('key', flat=True)), ['new'])
+
+    def test_direct_messages_broadcast_per_conversation(self):
+        from asgiref.sync import async_to_sync
+        layer, alice_channel = async_to_sync(self.listen)('chat_dm_alice_bot')
+        messages = [{'recipient': 'alice', 'message': 'hello'}, {'recipient': 'bob', 'message': 'hello'},
+                    {'recipient': 'alice', 'message': 'again'}]
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post('/api/direct-messages/bulk/', {'messages': messages},
+                                        content_type='application/json')
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(DirectMessage.objects.filter(sender=self.bot).count(), 3)
+        event = async_to_sync(layer.receive)(alice_channel)
+        self.assertEqual([m['message'] for m in event['messages']], ['hello', 'again'])
+        self.assertTrue(event['messages'][0]['is_dm'])
+
+
+@override_settings(ACTIVITY_ROLLUP_LAG_SECONDS=0)
+class ActivityRollupTests(TestCase):
+
+    def setUp(self):
+        self.alice, self.bob, self.carol = (User.objects.create(username=name) for name in ('alice', 'bob', 'carol'))
+        self.room = Room.objects.create(name='general')
+        self.start = datetime(2025, 3, 1, 9, tzinfo=timezone.utc)
+
+    def post(self, user, minutes, room=None):
+        message = Message.objects.create(room=room or self.room, user=user, content='hi')
+        Message.objects.filter(pk=message.pk).update(timestamp=self.start + timedelta(minutes=minutes))
+
+    def rollups(self):
+        return (
+            list(RoomActivity.objects.order_by('room_id', 'bucket').values_list('room', 'bucket', 'message_count', 'sender_count')),
+            sorted(RoomActivitySender.objects.values_list('room', 'bucket', 'user', 'message_count')),
+        )
+
+    def test_incremental_matches_full_rebuild(self):
+        self.post(self.alice, 0)
+        self.post(self.alice, 10)
+        self.post(self.bob, 70)
+        self.assertEqual(roll_up_messages(), 3)
+        self.assertEqual(
+            list(RoomActivity.objects.values_list('bucket', 'message_count', 'sender_count')),
+            [(self.start, 2, 1), (self.start + timedelta(hours=1), 1, 1)]
+        )
+
+        # Only rows past the watermark are read; existing buckets are topped up
+        self.post(self.bob, 20)
+        self.post(self.alice, 80)
+        self.post(self.carol, 20, room=Room.objects.create(name='other'))
+        self.assertEqual(roll_up_messages(), 3)
+        self.assertEqual(roll_up_messages(), 0)
+        incremental = self.rollups()
+        self.assertEqual(incremental[0][0][2:], (3, 2))
+
+        call_command('rollup_activity', '--rebuild', '--batch-size=2', stdout=io.StringIO())
+        self.assertEqual(self.rollups(), incremental)
+
+    def test_recent_messages_wait_for_the_lag(self):
+        Message.objects.create(room=self.room, user=self.alice, content='just now')
+        with override_settings(ACTIVITY_ROLLUP_LAG_SECONDS=60):
+            self.assertEqual(roll_up_messages(), 0)
+        self.assertEqual(roll_up_messages(), 1)
+
+    def test_stats_endpoint(self):
+        for minutes, user in ((0, self.alice), (5, self.alice), (30, self.bob), (60, self.alice), (24 * 60, self.carol)):
+            self.post(user, minutes)
+        roll_up_messages()
+        url = f'/api/rooms/{self.room.id}/stats/'
+
+        with self.assertNumQueries(5):
+            data = self.client.get(url, {'since': '2025-03-01T09:00:00Z', 'until': '2025-03-01T12:00:00Z'}).json()
+        self.assertEqual(data['messages'], 4)
+        self.assertEqual(data['active_users'], 2)
+        self.assertEqual([(b['messages'], b['senders']) for b in data['buckets']], [(3, 2), (1, 1)])
+        self.assertEqual(data['top_posters'], [{'username': 'alice', 'messages': 3}, {'username': 'bob', 'messages': 1}])
+        self.assertIsNotNone(data['rolled_up_through'])
+
+        data = self.client.get(url, {'since': '2025-03-01', 'until': '2025-03-03', 'interval': 'day', 'top': 1}).json()
+        self.assertEqual([(b['messages'], b['senders']) for b in data['buckets']], [(4, 2), (1, 1)])
+        self.assertEqual(data['active_users'], 3)
+        self.assertEqual(len(data['top_posters']), 1)
+
+        for params in ({'since': 'yesterday'}, {'interval': 'week'}, {'since': '2025-03-02', 'until': '2025-03-01'}):
+            self.assertEqual(self.client.get(url, params).status_code, 400)
+        self.assertEqual(self.client.get('/api/rooms/999/stats/').status_code, 404)
@@ -0,0 +1,417 @@
+"""
+Performance regression suite.
+
+Every REST action in core.views and every WebSocket flow runs against the
+same seeded data; its SQL query count must match tests/baselines/performance.json
+exactly. A change that adds queries per row or per recipient changes a count
+and fails with a diff. Query counts are the gate; wall times vary with machine
+load, so they are only checked when asked for:
+
+    PERF_TIME_BUDGETS=1 python manage.py test core.tests.test_performance
+
+After an intentional change, refresh the baselines and commit the file:
+
+    UPDATE_PERF_BASELINES=1 python manage.py test core.tests.test_performance
+
+Time budgets are derived from the timings measured by that run: each REST
+action runs BUDGET_RUNS times (rolled back in between) and its budget is
+the slowest run times BUDGET_SAFETY_FACTOR, but at least BUDGET_FLOOR_MS so
+that millisecond actions don't fail on scheduler noise. The slowest run,
+not the median, because a normal test run measures a single cold request
+(and e.g. only the first upload of a file actually writes it). WebSocket
+flows run once. The rule and its parameters are recorded in the file's
+"_budgets" entry. They are only meaningful on a machine comparable to the
+one that recorded them.
+"""
+import difflib
+import hashlib
+import json
+import math
+import os
+import platform
+import shutil
+import tempfile
+import time
+from pathlib import Path
+
+from channels.routing import URLRouter
+from channels.testing import WebsocketCommunicator
+from django.contrib.auth.models import User
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.db import DEFAULT_DB_ALIAS, connections, transaction
+from django.test import TestCase, override_settings
+from chatapp.urls import router
+from ..models import Room, Message, DirectMessage, Attachment
+from ..profiling import Operation
+from ..rollups import roll_up_messages
+from ..routing import websocket_urlpatterns
+
+BASELINE_FILE = Path(__file__).parent / 'baselines' / 'performance.json'
+UPDATE_BASELINES = os.environ.get('UPDATE_PERF_BASELINES') == '1'
+CHECK_TIME_BUDGETS = os.environ.get('PERF_TIME_BUDGETS') == '1'
+
+# How time budgets are derived from measured timings (see module docstring)
+BUDGET_RUNS = 5
+BUDGET_SAFETY_FACTOR = 3
+BUDGET_FLOOR_MS = 10
+
+# Seed sizes: big enough that any per-row query shows up in the counts
+ROOMS = 5
+MESSAGES_PER_ROOM = 8
+DM_THREAD_LENGTH = 12
+ROOM_LISTENERS = 3
+
+ATTACHMENT_ROOT = Path(tempfile.mkdtemp(prefix='chat-perf-'))
+MEASURED = {}
+
+
+def load_baselines():
+    """Baselines by action/flow name, without the "_budgets" description"""
+    with open(BASELINE_FILE) as f:
+        return {name: entry for name, entry in json.load(f).items() if not name.startswith('_')}
+
+
+def budget_ms(measured_ms):
+    return max(BUDGET_FLOOR_MS, math.ceil(measured_ms * BUDGET_SAFETY_FACTOR))
+
+
+def tearDownModule():
+    shutil.rmtree(ATTACHMENT_ROOT, ignore_errors=True)
+    if UPDATE_BASELINES and MEASURED:
+        baselines = load_baselines() if BASELINE_FILE.exists() else {}
+        for name, (queries, measured_ms) in MEASURED.items():
+            baselines[name] = {
+                'queries': queries,
+                'measured_ms': round(measured_ms, 2),
+                'budget_ms': budget_ms(measured_ms),
+            }
+        baselines['_budgets'] = {
+            'rule': 'budget_ms = max(floor_ms, ceil(measured_ms * safety_factor))',
+            'measured_ms': f'slowest of {BUDGET_RUNS} runs per REST action, one run per WebSocket flow',
+            'safety_factor': BUDGET_SAFETY_FACTOR,
+            'floor_ms': BUDGET_FLOOR_MS,
+            'enforced': 'only with PERF_TIME_BUDGETS=1',
+            'measured_with': f'Python {platform.python_version()} on {platform.machine()}, '
+                             f'{connections[DEFAULT_DB_ALIAS].vendor}',
+        }
+        BASELINE_FILE.parent.mkdir(exist_ok=True)
+        with open(BASELINE_FILE, 'w') as f:
+            json.dump(baselines, f, indent=2, sort_keys=True)
+            f.write('\n')
+
+
+class QueryLog:
+    """Execute wrapper that records every statement run on one connection"""
+
+    def __init__(self):
+        self.statements = []
+
+    def __call__(self, execute, sql, params, many, context):
+        self.statements.append(sql)
+        return execute(sql, params, many, context)
+
+
+class Measurement(Operation):
+    """Operation that also keeps the SQL it saw, for failure messages"""
+
+    def __init__(self, name):
+        super().__init__(name)
+        self.statements = []
+
+    def record_query(self, sql, duration):
+        super().record_query(sql, duration)
+        self.statements.append(sql)
+
+    def __exit__(self, *exc_info):
+        self.duration = time.perf_counter() - self.started
+        return super().__exit__(*exc_info)
+
+
+@override_settings(
+    CHANNEL_LAYERS={'default': {'BACKEND': 'channels.layers.InMemoryChannelLayer'}},
+    CHAT_LOCAL_FANOUT=False,
+    ATTACHMENT_ROOT=ATTACHMENT_ROOT,
+    ATTACHMENT_ACCEL_REDIRECT='',
+    PROFILING_SAMPLE_RATE=0,
+    PROFILING_SLOW_MS=0,
+    # Baselines count queries on the primary connection
+    DATABASE_REPLICAS=[],
+)
+class PerformanceRegressionTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.users = [User.objects.create(username=name) for name in ('alice', 'bob', 'carol', 'dave', 'erin')]
+        cls.rooms = [Room.objects.create(name=f'room{i}', description=f'Room {i}') for i in range(ROOMS)]
+        for room in cls.rooms:
+            room.members.set(cls.users)
+        Message.objects.bulk_create(
+            Message(room=room, user=cls.users[i % len(cls.users)], content=f'{room.name} message {i}')
+            for room in cls.rooms
+            for i in range(MESSAGES_PER_ROOM)
+        )
+        alice, bob = cls.users[:2]
+        DirectMessage.objects.bulk_create(
+            DirectMessage(
+                sender=alice if i % 2 else bob,
+                recipient=bob if i % 2 else alice,
+                content=f'dm {i}'
+            )
+            for i in range(DM_THREAD_LENGTH)
+        )
+
+        # Every message in room0 and the DM thread carries a file
+        content = b'attachment body'
+        sha256 = hashlib.sha256(content).hexdigest()
+        cls.room = cls.rooms[0]
+        for message in cls.room.messages.all():
+            Attachment.objects.create(
+                sha256=sha256, size=len(content), filename='notes.txt',
+                content_type='text/plain', uploaded_by=message.user, message=message
+            )
+        for dm in DirectMessage.objects.all():
+            Attachment.objects.create(
+                sha256=sha256, size=len(content), filename='notes.txt',
+                content_type='text/plain', uploaded_by=dm.sender, direct_message=dm
+            )
+        cls.attachment = Attachment.objects.first()
+        path = ATTACHMENT_ROOT / cls.attachment.storage_name
+        path.parent.mkdir(parents=True, exist_ok=True)
+        path.write_bytes(content)
+
+        cls.pending_attachment = Attachment.objects.create(
+            sha256=sha256, size=len(content), filename='pending.txt',
+            content_type='text/plain', uploaded_by=alice
+        )
+
+    # ------------------------
+    # HELPERS
+    # ------------------------
+
+    def assertWithinBaseline(self, name, queries, duration, statements):
+        MEASURED[name] = (queries, duration * 1000)
+        if UPDATE_BASELINES:
+            return
+        baseline = load_baselines().get(name)
+        if baseline is None or baseline['queries'] != queries:
+            diff = '\n'.join(difflib.unified_diff(
+                json.dumps({name: baseline and {'queries': baseline['queries']}}, indent=2).splitlines(),
+                json.dumps({name: {'queries': queries}}, indent=2).splitlines(),
+                'baseline', 'measured', lineterm=''
+            ))
+            queries_run = '\n'.join(f'{i}. {sql}' for i, sql in enumerate(statements, 1))
+            self.fail(f'{name} no longer matches its baseline:\n{diff}\n\nQueries:\n{queries_run}')
+        if CHECK_TIME_BUDGETS:
+            self.assertLessEqual(
+                duration * 1000, baseline['budget_ms'],
+                f'{name} took {duration * 1000:.1f}ms, budget is {baseline["budget_ms"]}ms'
+            )
+
+    def request(self, name, method, path, data=None, expected_status=200, **extra):
+        if data is not None and 'content_type' not in extra and method != 'post_multipart':
+            extra['content_type'] = 'application/json'
+            data = json.dumps(data)
+        if method == 'post_multipart':
+            method = 'post'
+        runs = BUDGET_RUNS if UPDATE_BASELINES else 1
+        durations = []
+        for run in range(runs):
+            if isinstance(data, dict):
+                for value in data.values():
+                    if hasattr(value, 'seek'):
+                        value.seek(0)
+            # Roll back all but the last run so each one sees the same data
+            with transaction.atomic():
+                with Measurement(name) as measurement:
+                    response = getattr(self.client, method)(path, data, **extra)
+                    if response.streaming:
+                        b''.join(response.streaming_content)
+                transaction.set_rollback(run < runs - 1)
+            self.assertEqual(response.status_code, expected_status, getattr(response, 'content', b'')[:500])
+            durations.append(measurement.duration)
+            if run == 0:
+                # Later runs may hit caches the first one filled; count the first
+                first = measurement
+        self.assertWithinBaseline(name, first.queries, max(durations), first.statements)
+        return response
+
+    def setUp(self):
+        # Consumers run their ORM calls on this (the test's) thread via
+        # database_sync_to_async, so capture queries on its connection
+        self.connection = connections[DEFAULT_DB_ALIAS]
+
+    def communicator(self, path):
+        return WebsocketCommunicator(URLRouter(websocket_urlpatterns), path)
+
+    # ------------------------
+    # COVERAGE
+    # ------------------------
+
+    def test_every_view_action_has_a_baseline(self):
+        if UPDATE_BASELINES:
+            self.skipTest('Updating baselines')
+        standard = ['list', 'retrieve', 'create', 'update', 'partial_update', 'destroy']
+        expected = {'ChatConsumer.connect', 'ChatConsumer.receive',
+                    'DirectMessageConsumer.connect', 'DirectMessageConsumer.receive'}
+        for prefix, viewset, basename in router.registry:
+            actions = [action for action in standard if hasattr(viewset, action)]
+            actions += [action.__name__ for action in viewset.get_extra_actions()]
+            expected.update(f'{viewset.__name__}.{action}' for action in actions)
+        self.assertEqual(set(load_baselines()), expected)
+
+    # ------------------------
+    # REST ENDPOINTS
+    # ------------------------
+
+    def test_room_list(self):
+        response = self.request('RoomViewSet.list', 'get', '/api/rooms/')
+        self.assertEqual(len(response.data), ROOMS)
+
+    def test_room_retrieve(self):
+        response = self.request('RoomViewSet.retrieve', 'get', f'/api/rooms/{self.room.id}/')
+        self.assertEqual(response.data['message_count'], MESSAGES_PER_ROOM)
+        self.assertEqual(response.data['member_count'], len(self.users))
+
+    def test_room_create(self):
+        self.request('RoomViewSet.create', 'post', '/api/rooms/', {'name': 'fresh'}, expected_status=201)
+
+    def test_room_update(self):
+        self.request('RoomViewSet.update', 'put', f'/api/rooms/{self.room.id}/',
+                     {'name': 'renamed', 'description': 'Renamed'})
+
+    def test_room_partial_update(self):
+        self.request('RoomViewSet.partial_update', 'patch', f'/api/rooms/{self.room.id}/',
+                     {'description': 'Updated'})
+
+    def test_room_destroy(self):
+        self.request('RoomViewSet.destroy', 'delete', f'/api/rooms/{self.room.id}/', expected_status=204)
+
+    def test_room_messages(self):
+        response = self.request('RoomViewSet.messages', 'get', f'/api/rooms/{self.room.id}/messages/')
+        self.assertEqual(len(response.data), MESSAGES_PER_ROOM)
+
+    def test_room_create_or_get(self):
+        self.request('RoomViewSet.create_or_get', 'post', '/api/rooms/create_or_get/', {'name': 'room1'})
+
+    def test_room_bulk_messages(self):
+        self.client.force_login(self.users[0])
+        messages = [{'message': f'bulk {i}'} for i in range(50)]
+        response = self.request('RoomViewSet.bulk_messages', 'post', f'/api/rooms/{self.room.id}/bulk_messages/',
+                                {'messages': messages}, expected_status=201, HTTP_IDEMPOTENCY_KEY='perf')
+        self.assertEqual(response.data['created'], 50)
+
+    def test_room_stats(self):
+        with override_settings(ACTIVITY_ROLLUP_LAG_SECONDS=0):
+            roll_up_messages()
+        response = self.request('RoomViewSet.stats', 'get', f'/api/rooms/{self.room.id}/stats/')
+        self.assertEqual(response.data['messages'], MESSAGES_PER_ROOM)
+
+    def test_message_list(self):
+        response = self.request('MessageViewSet.list', 'get', f'/api/messages/?room_id={self.room.id}')
+        self.assertEqual(len(response.data), MESSAGES_PER_ROOM)
+
+    def test_message_retrieve(self):
+        message = self.room.messages.first()
+        self.request('MessageViewSet.retrieve', 'get', f'/api/messages/{message.id}/')
+
+    def test_user_list(self):
+        self.request('UserViewSet.list', 'get', '/api/users/')
+
+    def test_user_retrieve(self):
+        self.request('UserViewSet.retrieve', 'get', f'/api/users/{self.users[0].id}/')
+
+    def test_user_search(self):
+        self.request('UserViewSet.search', 'get', '/api/users/search/?q=a')
+
+    def test_directmessage_list(self):
+        response = self.request('DirectMessageViewSet.list', 'get', '/api/direct-messages/')
+        self.assertEqual(len(response.data), DM_THREAD_LENGTH)
+
+    def test_directmessage_retrieve(self):
+        dm = DirectMessage.objects.first()
+        self.request('DirectMessageViewSet.retrieve', 'get', f'/api/direct-messages/{dm.id}/')
+
+    def test_directmessage_conversation(self):
+        response = self.request('DirectMessageViewSet.conversation', 'get',
+                                '/api/direct-messages/conversation/?user1=alice&user2=bob')
+        self.assertEqual(len(response.data['messages']), DM_THREAD_LENGTH)
+
+    def test_directmessage_bulk(self):
+        self.client.force_login(self.users[0])
+        messages = [{'message': f'bulk {i}', 'recipient': user.username} for i, user in enumerate(self.users[1:] * 10)]
+        response = self.request('DirectMessageViewSet.bulk', 'post', '/api/direct-messages/bulk/',
+                                {'messages': messages}, expected_status=201, HTTP_IDEMPOTENCY_KEY='perf')
+        self.assertEqual(response.data['created'], 40)
+
+    def test_attachment_list(self):
+        self.request('AttachmentViewSet.list', 'get', '/api/attachments/')
+
+    def test_attachment_retrieve(self):
+        self.request('AttachmentViewSet.retrieve', 'get', f'/api/attachments/{self.attachment.id}/')
+
+    def test_attachment_create(self):
+        upload = SimpleUploadedFile('upload.txt', b'new file', content_type='text/plain')
+        self.request('AttachmentViewSet.create', 'post_multipart', '/api/attachments/',
+                     {'file': upload, 'username': 'alice'}, expected_status=201)
+
+    def test_attachment_download(self):
+        self.request('AttachmentViewSet.download', 'get', f'/api/attachments/{self.attachment.id}/download/')
+
+    # ------------------------
+    # WEBSOCKET FLOWS
+    # ------------------------
+
+    async def assertWebsocketFlow(self, consumer_name, paths, payload):
+        """
+        Connect a socket per path, then send `payload` from the first one and
+        wait until every socket got the broadcast. Connect is measured per
+        socket; receive covers the save plus the fan-out to every recipient.
+        """
+        communicators = [self.communicator(path) for path in paths]
+        queries = QueryLog()
+        with self.connection.execute_wrapper(queries):
+            started = time.perf_counter()
+            for communicator in communicators:
+                connected, _ = await communicator.connect()
+                self.assertTrue(connected)
+                history = await communicator.receive_json_from()
+                self.assertEqual(history['type'], 'message_history')
+            connect_time = (time.perf_counter() - started) / len(paths)
+            connect_statements = list(queries.statements)
+
+            started = time.perf_counter()
+            await communicators[0].send_json_to(payload)
+            for communicator in communicators:
+                frame = await communicator.receive_json_from()
+                self.assertEqual(frame['message'], payload['message'])
+            receive_time = time.perf_counter() - started
+            receive_statements = queries.statements[len(connect_statements):]
+
+            for communicator in communicators:
+                await communicator.disconnect()
+
+        self.assertEqual(len(connect_statements) % len(paths), 0)
+        connect_queries = len(connect_statements) // len(paths)
+        self.assertWithinBaseline(
+            f'{consumer_name}.connect', connect_queries, connect_time, connect_statements[:connect_queries]
+        )
+        self.assertWithinBaseline(
+            f'{consumer_name}.receive', len(receive_statements), receive_time, receive_statements
+        )
+        return frame
+
+    async def test_chat_consumer(self):
+        frame = await self.assertWebsocketFlow(
+            'ChatConsumer',
+            [f'/ws/group/{self.room.name}/'] * ROOM_LISTENERS,
+            {'username': 'alice', 'message': 'hello room', 'attachments': [self.pending_attachment.id]}
+        )
+        self.assertEqual(frame['attachments'][0]['id'], self.pending_attachment.id)
+
+    async def test_direct_message_consumer(self):
+        frame = await self.assertWebsocketFlow(
+            'DirectMessageConsumer',
+            ['/ws/dm/bob/?user=alice', '/ws/dm/alice/?user=bob'],
+            {'username': 'alice', 'message': 'hello bob', 'attachments': [self.pending_attachment.id]}
+        )
+        self.assertEqual(frame['attachments'][0]['id'], self.pending_attachment.id)
@@ -1,21 +1,42 @@
+from datetime import datetime, timedelta, timezone
+
 from rest_framework import viewsets, status
 from rest_framework.decorators import action
+from rest_framework.permissions import IsAuthenticated
 from rest_framework.response import Response
+from django.conf import settings
 from django.contrib.auth.models import User
-from .models import Room, Message, DirectMessage
-from .serializers import RoomSerializer, MessageSerializer, UserSerializer, DirectMessageSerializer
+from django.shortcuts import get_object_or_404
+from django.utils import timezone as django_timezone
+from django.utils.dateparse import parse_date, parse_datetime
+from .attachments import AttachmentUploadHandler, attachment_response, discard_uploads, store_upload
+from .bulk import check_authors, idempotent_response, post_direct_messages, post_room_messages
+from .models import Room, Message, DirectMessage, Attachment
+from .profiling import ProfiledViewMixin
+from .replicas import ReplicaReadMixin, request_clients
+from .rollups import INTERVALS, room_stats
+from .serializers import (
+    RoomSerializer, MessageSerializer, UserSerializer, DirectMessageSerializer, AttachmentSerializer,
+    BulkMessagesSerializer, BulkDirectMessagesSerializer
+)
 
 
-class RoomViewSet(viewsets.ModelViewSet):
+class RoomViewSet(ProfiledViewMixin, ReplicaReadMixin, viewsets.ModelViewSet):
     """ViewSet for Room CRUD operations"""
-    queryset = Room.objects.all()
+    queryset = Room.objects.with_stats()
     serializer_class = RoomSerializer
+    replica_actions = ('list', 'retrieve', 'messages', 'stats')
     
     @action(detail=True, methods=['get'])
     def messages(self, request, pk=None):
         """Get all messages for a specific room"""
         room = self.get_object()
-        messages = Message.objects.filter(room=room).order_by('timestamp')
+        messages = (
+            Message.objects.filter(room=room)
+            .select_related('user')
+            .prefetch_related('attachments')
+            .order_by('timestamp')
+        )
         serializer = MessageSerializer(messages, many=True)
         return Response(serializer.data)
     
@@ -35,28 +56,90 @@ class RoomViewSet(viewsets.ModelViewSet):
             name=room_name,
             defaults={'description': description}
         )
+        # Reload with the list annotations instead of counting per field
+        room = self.get_queryset().get(pk=room.pk)
         serializer = self.get_serializer(room)
         return Response(serializer.data, status=status.HTTP_200_OK)
+    
+    @action(detail=True, methods=['post'], permission_classes=[IsAuthenticated])
+    def bulk_messages(self, request, pk=None):
+        """
+        Post up to BULK_MESSAGES_MAX messages at once (for bots and integrations).
+        Body: {"messages": [{"message": "...", "username": "optional"}, ...]};
+        `username` other than the caller's needs core.post_as_other_users.
+        Send an Idempotency-Key header so that retries don't post twice.
+        """
+        # Plain lookup; the list annotations aren't needed here
+        room = get_object_or_404(Room, pk=pk)
+        serializer = BulkMessagesSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        items = serializer.validated_data['messages']
+        check_authors(request.user, items)
+        return idempotent_response(
+            request, f'room:{room.pk}', items,
+            lambda: post_room_messages(room, request.user, items)
+        )
+
+    @action(detail=True, methods=['get'])
+    def stats(self, request, pk=None):
+        """
+        Room activity from the hourly rollups (see rollup_activity).
+        Query params: since/until (ISO date or datetime, default the last
+        24 hours), interval (hour or day), top (number of top posters).
+        """
+        room = get_object_or_404(Room, pk=pk)
+        try:
+            until = parse_range_param(request.query_params.get('until')) or django_timezone.now()
+            since = parse_range_param(request.query_params.get('since')) or until - timedelta(days=1)
+            top = int(request.query_params.get('top', 10))
+        except ValueError:
+            return Response(
+                {'error': 'since/until must be ISO dates or datetimes and top a number'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        interval = request.query_params.get('interval', 'hour')
+        if interval not in INTERVALS or since >= until or not 0 <= top <= 100:
+            return Response(
+                {'error': f'interval must be one of {", ".join(INTERVALS)}, since before until and top 0-100'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        return Response(room_stats(room, since, until, interval, top))
+
 
+def parse_range_param(value):
+    """ISO date or datetime as an aware datetime (UTC unless it says otherwise); None if empty"""
+    if not value:
+        return None
+    parsed = parse_datetime(value)
+    if parsed is None:
+        date = parse_date(value)
+        if date is None:
+            raise ValueError(value)
+        parsed = datetime.combine(date, datetime.min.time())
+    if django_timezone.is_naive(parsed):
+        parsed = parsed.replace(tzinfo=timezone.utc)
+    return parsed
 
-class MessageViewSet(viewsets.ReadOnlyModelViewSet):
+
+class MessageViewSet(ProfiledViewMixin, ReplicaReadMixin, viewsets.ReadOnlyModelViewSet):
     """ViewSet for Message read operations"""
-    queryset = Message.objects.all()
+    queryset = Message.objects.select_related('user').prefetch_related('attachments')
     serializer_class = MessageSerializer
     
     def get_queryset(self):
         """Filter messages by room if room_id is provided"""
-        queryset = Message.objects.all()
+        queryset = self.queryset
         room_id = self.request.query_params.get('room_id', None)
         if room_id:
             queryset = queryset.filter(room_id=room_id)
         return queryset.order_by('timestamp')
 
 
-class UserViewSet(viewsets.ReadOnlyModelViewSet):
+class UserViewSet(ProfiledViewMixin, ReplicaReadMixin, viewsets.ReadOnlyModelViewSet):
     """ViewSet for User read operations"""
     queryset = User.objects.all()
     serializer_class = UserSerializer
+    replica_actions = ('list', 'retrieve', 'search')
     
     @action(detail=False, methods=['get'])
     def search(self, request):
@@ -71,10 +154,15 @@ class UserViewSet(viewsets.ReadOnlyModelViewSet):
         return Response({'users': serializer.data})
 
 
-class DirectMessageViewSet(viewsets.ReadOnlyModelViewSet):
+class DirectMessageViewSet(ProfiledViewMixin, ReplicaReadMixin, viewsets.ReadOnlyModelViewSet):
     """ViewSet for DirectMessage read operations"""
-    queryset = DirectMessage.objects.all()
+    queryset = DirectMessage.objects.select_related('sender', 'recipient').prefetch_related('attachments')
     serializer_class = DirectMessageSerializer
+    replica_actions = ('list', 'retrieve', 'conversation')
+    
+    def replica_clients(self, request):
+        # A conversation is read by user1
+        return request_clients(request, request.GET.get('user'), request.GET.get('user1'))
     
     @action(detail=False, methods=['get'])
     def conversation(self, request):
@@ -92,7 +180,11 @@ class DirectMessageViewSet(viewsets.ReadOnlyModelViewSet):
             user1 = User.objects.get(username=user1_name)
             user2 = User.objects.get(username=user2_name)
             
-            messages = DirectMessage.get_conversation(user1, user2)
+            messages = (
+                DirectMessage.get_conversation(user1, user2)
+                .select_related('sender', 'recipient')
+                .prefetch_related('attachments')
+            )
             serializer = self.get_serializer(messages, many=True)
             return Response({'messages': serializer.data})
         
@@ -101,3 +193,73 @@ class DirectMessageViewSet(viewsets.ReadOnlyModelViewSet):
                 {'error': 'User not found'},
                 status=status.HTTP_404_NOT_FOUND
             )
+    
+    @action(detail=False, methods=['post'], permission_classes=[IsAuthenticated])
+    def bulk(self, request):
+        """
+        Send up to BULK_MESSAGES_MAX direct messages at once.
+        Body: {"messages": [{"recipient": "bob", "message": "...", "username": "optional"}, ...]}.
+        Honours the Idempotency-Key header like RoomViewSet.bulk_messages.
+        """
+        serializer = BulkDirectMessagesSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        items = serializer.validated_data['messages']
+        check_authors(request.user, items)
+        return idempotent_response(
+            request, 'direct-messages', items,
+            lambda: post_direct_messages(request.user, items)
+        )
+
+
+class AttachmentViewSet(ProfiledViewMixin, ReplicaReadMixin, viewsets.ReadOnlyModelViewSet):
+    """
+    ViewSet for chat attachments.
+    Upload with a multipart POST (field `file`; `username` of an existing
+    user unless logged in), then reference the returned id in a WebSocket
+    message's `attachments` list. Only the uploader can attach it.
+    """
+    queryset = Attachment.objects.all()
+    serializer_class = AttachmentSerializer
+    # Other members fetch a file right after it is broadcast, before a
+    # replica may have it, so attachments are always read from the primary
+    replica_actions = ()
+    
+    def initialize_request(self, request, *args, **kwargs):
+        # Must be in place before anything reads the body, so uploads stream
+        # straight to disk instead of through the default memory handler
+        request.upload_handlers = [AttachmentUploadHandler(request)]
+        return super().initialize_request(request, *args, **kwargs)
+    
+    def create(self, request):
+        """Store an uploaded file (deduplicated by content hash)"""
+        try:
+            upload = request.FILES.get('file')
+            if upload is None:
+                return Response(
+                    {'error': f'A file of at most {settings.ATTACHMENT_MAX_SIZE} bytes is required'},
+                    status=status.HTTP_400_BAD_REQUEST
+                )
+            
+            if request.user.is_authenticated:
+                uploaded_by = request.user
+            else:
+                # Uploads don't create accounts; the sender must already exist
+                uploaded_by = User.objects.filter(username=request.data.get('username') or None).first()
+                if uploaded_by is None:
+                    return Response(
+                        {'error': 'Log in or give the username of an existing user'},
+                        status=status.HTTP_400_BAD_REQUEST
+                    )
+            
+            attachment = store_upload(upload, uploaded_by=uploaded_by)
+        finally:
+            # Other file fields, repeated `file` parts and failed requests
+            # would otherwise leave their temp files behind
+            discard_uploads(request.FILES)
+        serializer = self.get_serializer(attachment)
+        return Response(serializer.data, status=status.HTTP_201_CREATED)
+    
+    @action(detail=True, methods=['get'])
+    def download(self, request, pk=None):
+        """Serve the file, with Range support"""
+        return attachment_response(request, self.get_object())
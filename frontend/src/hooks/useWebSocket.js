@@ -10,7 +10,11 @@ import { useEffect, useRef, useState, useCallback } from 'react';
 export const useWebSocket = (roomName, username, chatType = 'group') => {
   const [messages, setMessages] = useState([]);
   const [isConnected, setIsConnected] = useState(false);
+  // Bumped to reconnect when the server asks the client to come back later
+  const [reconnects, setReconnects] = useState(0);
   const ws = useRef(null);
+  const retryAfter = useRef(null);
+  const reconnectTimer = useRef(null);
 
   useEffect(() => {
     if (!roomName || !username) return;
@@ -34,9 +38,21 @@ export const useWebSocket = (roomName, username, chatType = 'group') => {
 
     ws.current.onmessage = (event) => {
       const data = JSON.parse(event.data);
+
+      if (data.type === 'ping') {
+        // Server heartbeat; sockets that don't answer are closed
+        event.target.send(JSON.stringify({ type: 'pong' }));
+        return;
+      }
       console.log('Received message:', data);
 
-      if (data.type === 'message_history') {
+      if (data.type === 'retry') {
+        // Server is at its connection limit; it closes with 1013 next
+        retryAfter.current = data.retry_after;
+      } else if (data.type === 'error') {
+        // The server rejected the last message without saving it
+        console.error('Message rejected:', data.message);
+      } else if (data.type === 'message_history') {
         // Load previous messages
         setMessages(data.messages);
       } else if (data.type === 'chat_message') {
@@ -46,6 +62,13 @@ export const useWebSocket = (roomName, username, chatType = 'group') => {
           message: data.message,
           timestamp: data.timestamp
         }]);
+      } else if (data.type === 'chat_batch') {
+        // Several messages coalesced by the server during a burst
+        setMessages(prev => [...prev, ...data.messages.map(msg => ({
+          username: msg.username,
+          message: msg.message,
+          timestamp: msg.timestamp
+        }))]);
       }
     };
 
@@ -57,15 +80,30 @@ export const useWebSocket = (roomName, username, chatType = 'group') => {
     ws.current.onclose = (event) => {
       console.log('WebSocket Disconnected', event.code, event.reason);
       setIsConnected(false);
+
+      // 1013: server busy, retry after its hint; 4002: connection reached
+      // its maximum lifetime, reconnect right away
+      let delay = null;
+      if (event.code === 1013) {
+        delay = (retryAfter.current || 5) * 1000;
+      } else if (event.code === 4002) {
+        delay = Math.random() * 1000;
+      }
+      retryAfter.current = null;
+      if (delay !== null) {
+        reconnectTimer.current = setTimeout(() => setReconnects(n => n + 1), delay);
+      }
     };
 
     // Cleanup on unmount
     return () => {
+      clearTimeout(reconnectTimer.current);
       if (ws.current) {
+        ws.current.onclose = null;
         ws.current.close();
       }
     };
-  }, [roomName, username, chatType]);
+  }, [roomName, username, chatType, reconnects]);
 
   const sendMessage = useCallback((message) => {
     if (ws.current && ws.current.readyState === WebSocket.OPEN) {